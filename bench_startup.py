@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+启动耗时基准
+每次在新进程中启动主程序或阅读器，记录导入完成、窗口第一次绘制和正文显示出来的时间，
+多次运行取中位数，结果追加到 bench_output.txt。
+阅读器使用临时的用户目录，不影响正常使用的配置和书库
+
+用法:
+    python bench_startup.py --runs 5
+    python bench_startup.py --target reader --book novels/xxx/xxx_完整版.txt
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+START = time.perf_counter()
+
+def child(target, book):
+    """在子进程中启动窗口，输出一行 JSON 计时结果"""
+    from PyQt5.QtWidgets import QApplication
+    from PyQt5.QtCore import QObject, QEvent, QTimer
+
+    timings = {}
+
+    def mark(name):
+        timings.setdefault(name, round((time.perf_counter() - START) * 1000, 1))
+
+    app = QApplication(sys.argv)
+    if target == 'main':
+        import main
+        mark('import')
+        window = main.MainWindow()
+    else:
+        import reader
+        mark('import')
+        window = reader.NovelReader()
+    mark('construct')
+
+    class PaintWatcher(QObject):
+        def eventFilter(self, obj, event):
+            if event.type() == QEvent.Paint and 'first_paint' not in timings:
+                mark('first_paint')
+                QTimer.singleShot(0, after_paint)
+            return False
+
+    def after_paint():
+        if 'spider_loaded' in timings:
+            return
+        if target == 'reader' and book:
+            window.load_book(book)
+            app.processEvents()
+            if window.text_display.document().characterCount() > 1:
+                mark('readable')
+        timings['spider_loaded'] = 'spider' in sys.modules
+        print(json.dumps(timings))
+        app.quit()
+
+    watcher = PaintWatcher()
+    window.installEventFilter(watcher)
+    window.show()
+    # 没有绘制事件的平台（例如无显示环境）上也能结束
+    QTimer.singleShot(10000, after_paint)
+    app.exec_()
+
+def run_once(target, book, home):
+    env = dict(os.environ)
+    if home:
+        env['HOME'] = home
+        env['USERPROFILE'] = home
+    command = [sys.executable, os.path.abspath(__file__), '--child', target]
+    if book:
+        command += ['--book', os.path.abspath(book)]
+    started = time.perf_counter()
+    output = subprocess.run(command, env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+                            capture_output=True, text=True, encoding='utf-8')
+    wall = round((time.perf_counter() - started) * 1000, 1)
+    for line in reversed(output.stdout.splitlines()):
+        if line.startswith('{'):
+            result = json.loads(line)
+            result['wall'] = wall
+            return result
+    raise RuntimeError(f"子进程没有输出计时结果:\n{output.stderr}")
+
+def main():
+    parser = argparse.ArgumentParser(description="启动耗时基准")
+    parser.add_argument('--target', choices=['main', 'reader'], default='main', help="启动主程序还是阅读器")
+    parser.add_argument('--book', default=None, help="阅读器打开的书籍，用于测量正文显示时间")
+    parser.add_argument('--runs', type=int, default=5, help="运行次数")
+    parser.add_argument('--output', default="bench_output.txt", help="结果追加到的文件")
+    parser.add_argument('--child', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.book)
+        return 0
+
+    # 同一次基准的各次运行共用临时用户目录：第一次为冷启动，之后可以用上清单等缓存
+    with tempfile.TemporaryDirectory() as home:
+        results = []
+        for i in range(args.runs):
+            result = run_once(args.target, args.book, home)
+            results.append(result)
+            print(f"第 {i + 1} 次: {result}")
+
+    keys = ['import', 'construct', 'first_paint', 'readable', 'wall']
+    summary = {key: statistics.median(r[key] for r in results) for key in keys
+               if all(key in r for r in results)}
+    line = (f"{time.strftime('%Y-%m-%d %H:%M:%S')} target={args.target} runs={args.runs} "
+            f"book={args.book or '-'} spider_loaded={any(r.get('spider_loaded') for r in results)} "
+            + " ".join(f"{key}={value:.1f}ms" for key, value in summary.items()))
+    print(line)
+    with open(args.output, 'a', encoding='utf-8') as f:
+        f.write(line + "\n")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
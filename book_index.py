@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+完整版小说文件的章节索引
+爬虫合并章节时在完整版文件旁写入清单，记录每章的字节偏移、长度、字数和全文哈希，
+阅读器据此按需定位读取章节，不必读入并切分整本书。没有清单的完整版文件
+由 build_manifest 通过 mmap 扫描一遍分隔线生成同样格式的清单
+"""
+
+import os
+import re
+import json
+import mmap
+import codecs
+import hashlib
+
+MANIFEST_VERSION = 1
+
+# 完整版文件中章节之间的分隔线
+SEPARATOR_PATTERN = re.compile(rb'={50,}')
+
+def chapter_filename(index, title):
+    """单章文件名: 0001_标题.txt，爬虫保存和阅读器查找章节时共用"""
+    safe_title = re.sub(r'[<>:"/\\|?*]', '_', title)
+    return f"{index:04d}_{safe_title}.txt"
+
+def manifest_path(merged_file):
+    """完整版文件对应的清单路径: xxx_完整版.txt -> xxx_完整版.manifest.json"""
+    return os.path.splitext(merged_file)[0] + ".manifest.json"
+
+def fallback_manifest_path(merged_file, index_dir):
+    """书籍所在目录不可写时，清单保存到 index_dir 下，以文件绝对路径的哈希命名"""
+    key = hashlib.sha1(os.path.abspath(merged_file).encode('utf-8')).hexdigest()
+    return os.path.join(index_dir, key + ".manifest.json")
+
+def save_manifest(merged_file, title, chapters, content_hash, path=None, encoding='utf-8'):
+    """写入清单，chapters 为 [{'title', 'offset', 'length', 'chars'}]，须在完整版文件写完后调用"""
+    stat = os.stat(merged_file)
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'title': title,
+        'file': os.path.basename(merged_file),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha1': content_hash,
+        'encoding': encoding,
+        'chapters': chapters
+    }
+    path = path or manifest_path(merged_file)
+    with open(path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(path + ".tmp", path)
+    return manifest
+
+def file_hash(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def hash_range(data, digest, start, end, chunk_size=1024 * 1024):
+    """把 data[start:end] 分块加入 digest，用于 mmap 等大对象"""
+    for position in range(start, end, chunk_size):
+        digest.update(data[position:min(end, position + chunk_size)])
+    return digest
+
+def load_manifest(merged_file, verify_hash=False, path=None):
+    """读取清单；清单不存在、格式不符或与文件大小/修改时间不一致时返回 None"""
+    path = path or manifest_path(merged_file)
+    try:
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        stat = os.stat(merged_file)
+        if manifest.get('version') != MANIFEST_VERSION or manifest.get('size') != stat.st_size:
+            return None
+        if manifest.get('mtime_ns') != stat.st_mtime_ns:
+            # 修改时间变化（例如文件被复制）时用哈希确认内容是否一致
+            if file_hash(merged_file) != manifest.get('sha1'):
+                return None
+            # 记下新的修改时间，下次打开不必再计算哈希
+            try:
+                manifest = save_manifest(merged_file, manifest.get('title', ''), manifest['chapters'],
+                                         manifest['sha1'], path, manifest.get('encoding', 'utf-8'))
+            except OSError as e:
+                print(f"更新章节清单失败: {e}")
+        elif verify_hash and file_hash(merged_file) != manifest.get('sha1'):
+            return None
+        return manifest
+    except Exception as e:
+        print(f"读取章节清单失败: {e}")
+        return None
+
+def scan_chapters(data, start=0, encoding='utf-8'):
+    """从 start 开始按分隔线切分章节，返回 [{'title', 'offset', 'length'}]
+
+    start 须位于章节开头；文件末尾追加了内容时，从最后一章的偏移重新扫描即可得到增长后的最后一章和新增的章节。
+    从文件开头扫描时跳过 UTF-8 BOM，第一章的偏移从 BOM 之后开始
+    """
+    if start == 0 and data[:len(codecs.BOM_UTF8)] == codecs.BOM_UTF8:
+        start = len(codecs.BOM_UTF8)
+    chapters = []
+    bounds = [m.span() for m in SEPARATOR_PATTERN.finditer(data, start)] + [(len(data), len(data))]
+    for sep_start, sep_end in bounds:
+        part = data[start:sep_start]
+        stripped = part.strip()
+        if stripped:
+            offset = start + len(part) - len(part.lstrip())
+            title = stripped.split(b'\n', 1)[0].decode(encoding, errors='replace').strip()
+            chapters.append({'title': title, 'offset': offset, 'length': len(stripped)})
+        start = sep_end
+    return chapters
+
+def build_manifest(merged_file, encoding='utf-8'):
+    """通过 mmap 扫描一遍完整版文件，按分隔线切分章节，返回清单（不写盘）
+
+    只解码每章的首行作为标题，正文在阅读时再按偏移读取；文件以爬虫写入的书名行开头时跳过书名，
+    与爬虫合并时生成的清单一致
+    """
+    title = os.path.basename(merged_file)
+    if title.endswith('_完整版.txt'):
+        title = title[:-len('_完整版.txt')]
+    with open(merged_file, 'rb') as f:
+        stat = os.fstat(f.fileno())
+        if stat.st_size == 0:
+            return {'version': MANIFEST_VERSION, 'title': '', 'file': os.path.basename(merged_file),
+                    'size': 0, 'mtime_ns': stat.st_mtime_ns, 'sha1': hashlib.sha1().hexdigest(),
+                    'encoding': encoding, 'chapters': []}
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start = len(codecs.BOM_UTF8) if mm[:len(codecs.BOM_UTF8)] == codecs.BOM_UTF8 else 0
+            header = f"{title}\n\n".encode(encoding, errors='replace')
+            if mm[start:start + len(header)] == header:
+                start += len(header)
+            chapters = scan_chapters(mm, start, encoding)
+            content_hash = hashlib.sha1(mm).hexdigest()
+    
+    return {
+        'version': MANIFEST_VERSION,
+        'title': title,
+        'file': os.path.basename(merged_file),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha1': content_hash,
+        'encoding': encoding,
+        'chapters': chapters
+    }
+
+def load_or_build_manifest(merged_file, index_dir=None, encoding='utf-8'):
+    """读取书旁或 index_dir 中的清单，都无效或编码不符时重新扫描生成并保存"""
+    fallback_path = fallback_manifest_path(merged_file, index_dir) if index_dir else None
+    for path in (None, fallback_path) if fallback_path else (None,):
+        manifest = load_manifest(merged_file, path=path)
+        # 旧版清单没有记录编码，都是按 UTF-8 生成的
+        if manifest is not None and manifest.get('encoding', 'utf-8') == encoding:
+            return manifest
+    
+    manifest = build_manifest(merged_file, encoding)
+    for path in (manifest_path(merged_file), fallback_path):
+        if not path:
+            continue
+        try:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            save_manifest(merged_file, manifest['title'], manifest['chapters'], manifest['sha1'], path, encoding)
+            break
+        except OSError as e:
+            print(f"保存章节清单失败: {e}")
+    return manifest
+
+def decode_chapter(data, entry=None, encoding='utf-8'):
+    """解码一章的字节，返回 (标题, 正文)"""
+    text = data.decode(encoding, errors='replace')
+    lines = text.split('\n', 1)
+    title = lines[0].strip() or (entry or {}).get('title', '')
+    content = lines[1].strip() if len(lines) > 1 else text
+    return title, content
+
+def read_chapter(f, entry, encoding='utf-8'):
+    """从已打开的二进制文件中读取一章，返回 (标题, 正文)"""
+    f.seek(entry['offset'])
+    return decode_chapter(f.read(entry['length']), entry, encoding)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+下载服务端到端检查
+在本机启动一个模拟小说站点和下载服务，通过 HTTP 接口提交任务、读取进度事件流，
+确认章节全部下载、合并文件生成、事件流能按 Last-Event-ID 续传。不访问外部网络，
+下载目录和进度文件都放在临时目录中
+
+用法:
+    python check_service.py --chapters 20
+"""
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+import threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from spider import NovelSpider
+from service import DownloadService, ServiceServer
+
+NOVEL_ID = "12345"
+NOVEL_TITLE = "测试小说"
+
+class FakeSiteHandler(BaseHTTPRequestHandler):
+    """模拟站点：/book/<id>/ 为目录页，/book/<id>/<n>.html 为章节页"""
+    def log_message(self, format, *args):
+        pass
+
+    def send_html(self, html, status=200):
+        body = html.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        chapters = self.server.chapters
+        if self.path == f"/book/{NOVEL_ID}/":
+            links = "".join(f'<dd><a href="/book/{NOVEL_ID}/{i}.html">第{i}章 测试</a></dd>'
+                            for i in range(1, chapters + 1))
+            self.send_html(f'<html><head><title>{NOVEL_TITLE}</title></head><body>'
+                           f'<h1>{NOVEL_TITLE}</h1><div class="listmain"><dl>{links}</dl></div></body></html>')
+            return
+        name = self.path.rsplit('/', 1)[-1]
+        if self.path.startswith(f"/book/{NOVEL_ID}/") and name.endswith('.html') and name[:-5].isdigit():
+            index = int(name[:-5])
+            if 1 <= index <= chapters:
+                paragraphs = "".join(f"<p>第{index}章的第{j}段正文，用于检查下载服务。</p>" for j in range(1, 6))
+                self.send_html(f'<html><body><h1>第{index}章 测试</h1>'
+                               f'<div id="chaptercontent">{paragraphs}</div></body></html>')
+                return
+        self.send_html("<html><body>not found</body></html>", 404)
+
+def start_server(server):
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return "http://%s:%d" % server.server_address[:2]
+
+def request_json(url, data=None):
+    body = json.dumps(data).encode('utf-8') if data is not None else None
+    request = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return json.loads(response.read().decode('utf-8'))
+
+def read_events(url, last_event_id=None):
+    """读取事件流直到服务端关闭连接，返回事件列表"""
+    headers = {'Accept': 'text/event-stream'}
+    if last_event_id is not None:
+        headers['Last-Event-ID'] = last_event_id
+    events = []
+    with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=60) as response:
+        for line in response:
+            line = line.decode('utf-8').rstrip('\n')
+            if line.startswith('data: '):
+                events.append(json.loads(line[len('data: '):]))
+    return events
+
+def check(condition, message):
+    print(f"{'✓' if condition else '✗'} {message}")
+    return condition
+
+def main():
+    parser = argparse.ArgumentParser(description="下载服务端到端检查")
+    parser.add_argument('--chapters', type=int, default=20, help="模拟站点的章节数")
+    parser.add_argument('--workers', type=int, default=3, help="下载线程数")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        site = ThreadingHTTPServer(('127.0.0.1', 0), FakeSiteHandler)
+        site.daemon_threads = True
+        site.chapters = args.chapters
+        site_url = start_server(site)
+
+        spider = NovelSpider(base_url=site_url, max_workers=args.workers, store=True)
+        spider.progress_file = os.path.join(work_dir, "download_progress.json")
+        service = DownloadService(spider)
+        server = ServiceServer(('127.0.0.1', 0), service)
+        service_url = start_server(server)
+
+        ok = True
+        try:
+            output_dir = os.path.join(work_dir, "novels")
+            job = request_json(f"{service_url}/jobs", {'novel_id': NOVEL_ID, 'output_dir': output_dir})
+            events = read_events(f"{service_url}/jobs/{job['id']}/events")
+            statuses = [event['status'] for event in events if event['type'] == 'status']
+            chapter_events = [event for event in events if event['type'] == 'chapter']
+            ok &= check(statuses[-1:] == ['done'], f"任务状态: {' -> '.join(statuses)}")
+            ok &= check(len(chapter_events) == args.chapters and all(event['ok'] for event in chapter_events),
+                        f"章节事件 {len(chapter_events)}/{args.chapters}")
+            ok &= check([event['seq'] for event in events] == list(range(len(events))), "事件序号连续")
+
+            resumed = read_events(f"{service_url}/jobs/{job['id']}/events", str(events[-2]['seq']))
+            ok &= check([event['seq'] for event in resumed] == [events[-1]['seq']], "按 Last-Event-ID 续传")
+            replayed = read_events(f"{service_url}/jobs/{job['id']}/events", "abc")
+            ok &= check(len(replayed) == len(events), "无法识别的 Last-Event-ID 从头推送")
+
+            detail = request_json(f"{service_url}/jobs/{job['id']}")
+            novel_dir = detail.get('novel_dir') or ''
+            merged_file = os.path.join(novel_dir, f"{detail.get('title')}_完整版.txt")
+            chapter_files = [name for name in os.listdir(novel_dir) if name[:4].isdigit()] if novel_dir else []
+            ok &= check(len(chapter_files) == args.chapters, f"章节文件 {len(chapter_files)}/{args.chapters}")
+            ok &= check(os.path.exists(merged_file), "已生成完整版文件")
+        finally:
+            server.shutdown()
+            server.server_close()
+            service.shutdown()
+            site.shutdown()
+            site.server_close()
+
+    print("检查通过" if ok else "检查失败")
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
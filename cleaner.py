@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+章节正文清理模块
+用 Aho-Corasick 自动机一次扫描匹配广告短语黑名单和网址，只删除主要由广告构成的整行，
+不改动正文行的内容；并学习同一本小说大部分章节中都出现的模板行
+"""
+
+import os
+import re
+import json
+import time
+import bisect
+import threading
+from collections import deque, Counter
+
+# 常见镜像站广告和页脚短语
+DEFAULT_AD_PHRASES = [
+    '请收藏本站', '请收藏', '本站地址', '天才一秒记住', '一秒记住', '手机版阅读网址',
+    '手机用户请浏览', '最新章节', '全文阅读', '笔趣阁', '加入书签', '推荐本书',
+    '章节错误', '点此报错', '点此举报', '请记住本书首发域名', '本章未完', '点击下一页继续阅读',
+]
+
+# 不带协议的域名只匹配小写 ASCII，避免把 "Mr.Info" 之类的英文当成网址
+URL_PATTERN = re.compile(
+    r'(?i:(?:https?://|www\.)[\w\-./?=&%#:]+)'
+    r'|(?<![A-Za-z0-9\-.])[a-z0-9\-]+(?:\.[a-z0-9\-]+)*\.(?:com|net|org|cc|la|cfd|info|xyz)(?![A-Za-z0-9\-])'
+)
+
+class PhraseMatcher:
+    """Aho-Corasick 多模式匹配，一次扫描找出文本中所有黑名单短语"""
+    def __init__(self, phrases):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [0]  # 以该节点结尾的最长短语长度
+
+        for phrase in phrases:
+            phrase = phrase.lower()
+            if not phrase:
+                continue
+            node = 0
+            for ch in phrase:
+                nxt = self.goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(0)
+                    self.goto[node][ch] = nxt
+                node = nxt
+            self.output[node] = max(self.output[node], len(phrase))
+
+        # 广度优先构建失败指针
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self.goto[node].items():
+                queue.append(nxt)
+                fallback = self.fail[node]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[nxt] = self.goto[fallback].get(ch, 0)
+                self.output[nxt] = max(self.output[nxt], self.output[self.fail[nxt]])
+
+    def find_spans(self, text):
+        """返回所有匹配的 (start, end) 区间"""
+        lowered = text.lower()
+        if len(lowered) != len(text):
+            lowered = text
+        goto, fail, output = self.goto, self.fail, self.output
+        spans = []
+        node = 0
+        for i, ch in enumerate(lowered):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if output[node]:
+                spans.append((i + 1 - output[node], i + 1))
+        return spans
+
+class ContentCleaner:
+    """章节正文清理：广告短语、网址和按小说学习到的模板行"""
+    def __init__(self, phrases=None, phrases_file=None, max_ad_line=80, ad_coverage=0.6,
+                 learn_ratio=0.8, min_learn_chapters=20, min_learn_length=6, max_tracked_lines=200000):
+        phrases = list(phrases or DEFAULT_AD_PHRASES)
+        if phrases_file and os.path.exists(phrases_file):
+            with open(phrases_file, 'r', encoding='utf-8') as f:
+                phrases.extend(line.strip() for line in f if line.strip())
+        self.matcher = PhraseMatcher(phrases)
+        self.max_ad_line = max_ad_line
+        # 广告短语和网址占一行文字的比例达到该值时整行删除，否则整行保留
+        self.ad_coverage = ad_coverage
+        # 至少统计 min_learn_chapters 章后，出现在 learn_ratio 以上章节中的短行才视为模板行
+        self.learn_ratio = learn_ratio
+        self.min_learn_chapters = min_learn_chapters
+        self.min_learn_length = min_learn_length
+        self.max_tracked_lines = max_tracked_lines
+        self.novels = {}  # novel_id -> {'chapters': int, 'counts': Counter, 'boilerplate': set}
+        self.lock = threading.Lock()
+        self.stats = {'chapters': 0, 'seconds': 0.0, 'chars_in': 0, 'chars_out': 0, 'lines_removed': 0}
+
+    def _novel_state(self, novel_id):
+        with self.lock:
+            if novel_id not in self.novels:
+                self.novels[novel_id] = {'chapters': 0, 'counts': Counter(), 'boilerplate': set()}
+            return self.novels[novel_id]
+
+    def _learn(self, state, lines):
+        """统计各行出现在多少个章节中，出现比例达到 learn_ratio 的短行视为模板行
+
+        比例随章节增加重新计算，只在前几章反复出现的行（例如剧情中的系统提示）会被移出
+        """
+        candidates = {line for line in lines
+                      if self.min_learn_length <= len(line) <= self.max_ad_line}
+        with self.lock:
+            counts = state['counts']
+            state['chapters'] += 1
+            for line in candidates:
+                counts[line] += 1
+            if state['chapters'] >= self.min_learn_chapters:
+                threshold = state['chapters'] * self.learn_ratio
+                for line in candidates:
+                    if counts[line] >= threshold:
+                        state['boilerplate'].add(line)
+                for line in [line for line in state['boilerplate'] if counts[line] < threshold]:
+                    state['boilerplate'].discard(line)
+            if len(counts) > self.max_tracked_lines:
+                # 只出现过一次的行占绝大多数，定期丢弃以限制内存
+                for line in [line for line, count in counts.items() if count <= 1]:
+                    del counts[line]
+
+    def clean(self, text, novel_id=None):
+        """清理一章正文，novel_id 不为空时同时学习并去除该小说的模板行"""
+        start = time.perf_counter()
+        state = self._novel_state(novel_id) if novel_id is not None else None
+
+        lines = text.split('\n')
+        line_starts = []
+        offset = 0
+        for line in lines:
+            line_starts.append(offset)
+            offset += len(line) + 1
+
+        # 一次扫描全文，把命中区间归到各行
+        hits = {}
+        for span_start, span_end in self.matcher.find_spans(text):
+            line_no = bisect.bisect_right(line_starts, span_start) - 1
+            hits.setdefault(line_no, []).append(
+                (span_start - line_starts[line_no], span_end - line_starts[line_no])
+            )
+
+        kept = []
+        seen = []
+        removed = 0
+        boilerplate = state['boilerplate'] if state else ()
+        for line_no, line in enumerate(lines):
+            stripped = line.strip()
+            if not stripped:
+                kept.append('')
+                continue
+            seen.append(stripped)
+            if stripped in boilerplate:
+                removed += 1
+                continue
+            spans = hits.get(line_no, []) + [m.span() for m in URL_PATTERN.finditer(line)]
+            if spans:
+                # 正文中顺带出现的短语（例如对话里的“最新章节”）不删，整行保留
+                total = sum(1 for ch in stripped if ch.isalnum())
+                covered = sum(1 for span_start, span_end in self._merge_spans(spans)
+                              for ch in line[span_start:span_end] if ch.isalnum())
+                if covered >= total * self.ad_coverage:
+                    removed += 1
+                    continue
+            kept.append(line)
+
+        if state is not None:
+            self._learn(state, seen)
+
+        cleaned = re.sub(r'\n{3,}', '\n\n', '\n'.join(kept)).strip()
+        with self.lock:
+            self.stats['chapters'] += 1
+            self.stats['seconds'] += time.perf_counter() - start
+            self.stats['chars_in'] += len(text)
+            self.stats['chars_out'] += len(cleaned)
+            self.stats['lines_removed'] += removed
+        return cleaned
+
+    @staticmethod
+    def _merge_spans(spans):
+        """合并重叠的区间，返回按起点排序的不重叠区间"""
+        merged = []
+        for span_start, span_end in sorted(spans):
+            if merged and span_start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], span_end))
+            else:
+                merged.append((span_start, span_end))
+        return merged
+
+    def strip_boilerplate(self, text, novel_id):
+        """只去除已学习到的模板行，不再学习，合并时用于清理学习完成前写入的章节"""
+        state = self._novel_state(novel_id)
+        if not state['boilerplate']:
+            return text
+        lines = [line for line in text.split('\n') if line.strip() not in state['boilerplate']]
+        return re.sub(r'\n{3,}', '\n\n', '\n'.join(lines))
+
+    def load_boilerplate(self, novel_id, novel_dir):
+        """读取该小说之前学习到的模板行及其出现的章节数，之后的章节继续累计比例"""
+        path = os.path.join(novel_dir, '.boilerplate.json')
+        try:
+            if os.path.exists(path):
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                # 旧版只保存了按固定次数学到的行列表，没有比例信息，不再沿用
+                if isinstance(data, dict):
+                    state = self._novel_state(novel_id)
+                    with self.lock:
+                        state['chapters'] = max(state['chapters'], data.get('chapters', 0))
+                        for line, count in data.get('lines', {}).items():
+                            state['counts'][line] = max(state['counts'][line], count)
+                            state['boilerplate'].add(line)
+        except Exception as e:
+            print(f"加载模板行失败: {e}")
+
+    def save_boilerplate(self, novel_id, novel_dir):
+        state = self._novel_state(novel_id)
+        if not state['chapters']:
+            return
+        with self.lock:
+            data = {'chapters': state['chapters'],
+                    'lines': {line: state['counts'][line] for line in sorted(state['boilerplate'])}}
+        try:
+            with open(os.path.join(novel_dir, '.boilerplate.json'), 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+        except Exception as e:
+            print(f"保存模板行失败: {e}")
+
+    def report(self):
+        """清理耗时和体积统计"""
+        stats = self.stats
+        if not stats['chapters']:
+            return "未清理任何章节"
+        average_ms = stats['seconds'] / stats['chapters'] * 1000
+        saved = 1 - stats['chars_out'] / stats['chars_in'] if stats['chars_in'] else 0
+        return (f"清理 {stats['chapters']} 章，平均每章 {average_ms:.2f} ms，"
+                f"删除 {stats['lines_removed']} 行，"
+                f"字数 {stats['chars_in']} -> {stats['chars_out']} (减少 {saved:.1%})")
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+阅读器书库数据库
+书籍、书签、每本书的阅读位置和阅读会话保存在同一个 SQLite 文件中，
+每次修改只写一行。第一次打开时导入旧版的 bookmarks.json、reading_stats.json
+和 config.json 中的阅读位置
+"""
+
+import os
+import json
+import time
+import sqlite3
+from datetime import datetime
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    title TEXT,
+    added_time REAL NOT NULL,
+    last_opened REAL
+);
+CREATE TABLE IF NOT EXISTS bookmarks (
+    id INTEGER PRIMARY KEY,
+    book_id INTEGER NOT NULL REFERENCES books(id) ON DELETE CASCADE,
+    chapter_index INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    note TEXT NOT NULL DEFAULT '',
+    created_time TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_bookmarks_book ON bookmarks(book_id);
+CREATE TABLE IF NOT EXISTS positions (
+    book_id INTEGER PRIMARY KEY REFERENCES books(id) ON DELETE CASCADE,
+    chapter_index INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    updated_time REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    book_id INTEGER NOT NULL REFERENCES books(id) ON DELETE CASCADE,
+    start_time REAL NOT NULL,
+    minutes INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_book ON sessions(book_id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+class LibraryDB:
+    """书库数据库，只在界面线程中使用
+
+    数据库在第一次查询时才打开，启动时不必等待建表和导入旧数据
+    """
+    def __init__(self, config_dir):
+        self.config_dir = config_dir
+        self.db_file = os.path.join(config_dir, "library.db")
+        self._conn = None
+        self.book_ids = {}
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            os.makedirs(self.config_dir, exist_ok=True)
+            conn = sqlite3.connect(self.db_file)
+            conn.row_factory = sqlite3.Row
+            # WAL 模式下单行写入不需要每次同步整个数据库文件
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            conn.executescript(SCHEMA)
+            self._conn = conn
+            self.migrate_json()
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def book_id(self, book_path, create=True):
+        """书籍编号，不存在时登记"""
+        if book_path in self.book_ids:
+            return self.book_ids[book_path]
+        row = self.conn.execute("SELECT id FROM books WHERE path = ?", (book_path,)).fetchone()
+        if row:
+            book_id = row['id']
+        elif create:
+            with self.conn:
+                book_id = self.conn.execute(
+                    "INSERT INTO books (path, added_time) VALUES (?, ?)", (book_path, time.time())
+                ).lastrowid
+        else:
+            return None
+        self.book_ids[book_path] = book_id
+        return book_id
+
+    def touch_book(self, book_path, title=None):
+        """记录打开时间"""
+        book_id = self.book_id(book_path)
+        with self.conn:
+            self.conn.execute("UPDATE books SET last_opened = ?, title = COALESCE(?, title) WHERE id = ?",
+                              (time.time(), title, book_id))
+
+    def add_bookmark(self, book_path, chapter_index, position, note="", created_time=None):
+        book_id = self.book_id(book_path)
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO bookmarks (book_id, chapter_index, position, note, created_time) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (book_id, chapter_index, position, note, created_time or datetime.now().isoformat())
+            )
+
+    def get_bookmarks(self, book_path):
+        book_id = self.book_id(book_path, create=False)
+        if book_id is None:
+            return []
+        rows = self.conn.execute(
+            "SELECT id, chapter_index, position, note, created_time FROM bookmarks "
+            "WHERE book_id = ? ORDER BY id", (book_id,)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def remove_bookmark(self, bookmark_id):
+        with self.conn:
+            self.conn.execute("DELETE FROM bookmarks WHERE id = ?", (bookmark_id,))
+
+    def save_position(self, book_path, chapter_index, position):
+        book_id = self.book_id(book_path)
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO positions (book_id, chapter_index, position, updated_time) "
+                "VALUES (?, ?, ?, ?)",
+                (book_id, chapter_index, position, time.time())
+            )
+
+    def get_position(self, book_path):
+        """返回 (章节序号, 滚动位置)，没有记录时返回 None"""
+        book_id = self.book_id(book_path, create=False)
+        if book_id is None:
+            return None
+        row = self.conn.execute("SELECT chapter_index, position FROM positions WHERE book_id = ?",
+                                (book_id,)).fetchone()
+        return (row['chapter_index'], row['position']) if row else None
+
+    def start_session(self, book_path, minutes=0, start_time=None):
+        """开始一次阅读会话，返回会话编号"""
+        book_id = self.book_id(book_path)
+        with self.conn:
+            return self.conn.execute(
+                "INSERT INTO sessions (book_id, start_time, minutes) VALUES (?, ?, ?)",
+                (book_id, time.time() if start_time is None else start_time, minutes)
+            ).lastrowid
+
+    def add_session_time(self, session_id, minutes):
+        with self.conn:
+            self.conn.execute("UPDATE sessions SET minutes = minutes + ? WHERE id = ?", (minutes, session_id))
+
+    def get_stats(self, book_path):
+        book_id = self.book_id(book_path, create=False)
+        if book_id is None:
+            return {'total_time': 0, 'sessions': 0}
+        row = self.conn.execute(
+            "SELECT COALESCE(SUM(minutes), 0) AS total_time, COUNT(*) AS sessions "
+            "FROM sessions WHERE book_id = ?", (book_id,)
+        ).fetchone()
+        return {'total_time': row['total_time'], 'sessions': row['sessions']}
+
+    def _load_json(self, filename):
+        path = os.path.join(self.config_dir, filename)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"读取 {filename} 失败: {e}")
+            return None
+
+    def migrate_json(self):
+        """只执行一次：导入旧版 JSON 文件中的书签、统计和阅读位置，原文件保留不动"""
+        if self.conn.execute("SELECT 1 FROM meta WHERE key = 'json_migrated'").fetchone():
+            return
+
+        bookmarks = self._load_json("bookmarks.json") or {}
+        for book_path, items in bookmarks.items():
+            for bookmark in items:
+                self.add_bookmark(book_path, bookmark.get('chapter_index', 0), bookmark.get('position', 0),
+                                  bookmark.get('note', ""), bookmark.get('created_time'))
+
+        stats = self._load_json("reading_stats.json") or {}
+        for book_path, book_stats in stats.items():
+            if book_stats.get('total_time'):
+                self.start_session(book_path, book_stats['total_time'], start_time=0)
+
+        config = self._load_json("config.json") or {}
+        if config.get('last_book'):
+            self.save_position(config['last_book'], config.get('last_chapter', 0), config.get('last_position', 0))
+
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrated', ?)",
+                              (datetime.now().isoformat(),))
+        if bookmarks or stats:
+            print(f"已导入 {sum(len(items) for items in bookmarks.values())} 个书签和 {len(stats)} 本书的阅读统计")
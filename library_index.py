@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+下载目录的书籍索引
+记录 novels/ 下每本书的书名、完整版文件、章节文件数和大小，保存在目录中的
+.library_index.json。重新扫描时只列出修改时间变化的书籍目录，其余沿用索引中的记录
+"""
+
+import os
+import json
+import threading
+
+INDEX_VERSION = 1
+INDEX_FILENAME = ".library_index.json"
+
+def scan_book_dir(path):
+    """列出一本书的目录，返回索引记录"""
+    merged_file = None
+    chapter_count = 0
+    size = 0
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if not entry.name.endswith('.txt') or not entry.is_file():
+                continue
+            size += entry.stat().st_size
+            if entry.name.endswith('_完整版.txt'):
+                merged_file = merged_file or entry.name
+            else:
+                chapter_count += 1
+    return {
+        'title': merged_file[:-len('_完整版.txt')] if merged_file else os.path.basename(path),
+        'merged_file': merged_file,
+        'chapters': chapter_count,
+        'size': size
+    }
+
+class LibraryIndex:
+    """下载目录的增量索引，scan 可以在后台线程中调用"""
+    def __init__(self, novels_dir):
+        self.novels_dir = novels_dir
+        self.index_file = os.path.join(novels_dir, INDEX_FILENAME)
+        self.lock = threading.Lock()
+        self.books = self.load_index()
+
+    def load_index(self):
+        try:
+            if os.path.exists(self.index_file):
+                with open(self.index_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get('version') == INDEX_VERSION:
+                    return data['books']
+        except Exception as e:
+            print(f"加载书籍索引失败: {e}")
+        return {}
+
+    def save_index(self):
+        with self.lock:
+            data = json.dumps({'version': INDEX_VERSION, 'books': self.books},
+                              ensure_ascii=False, separators=(',', ':'))
+        try:
+            tmp_file = self.index_file + ".tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(tmp_file, self.index_file)
+        except OSError as e:
+            print(f"保存书籍索引失败: {e}")
+
+    def scan(self, should_stop=None):
+        """对比书籍目录的修改时间增量更新索引，返回按修改时间从新到旧排列的书籍列表"""
+        if not os.path.isdir(self.novels_dir):
+            return []
+        with self.lock:
+            books = dict(self.books)
+        seen = set()
+        changed = False
+        with os.scandir(self.novels_dir) as entries:
+            for entry in entries:
+                if should_stop and should_stop():
+                    return None
+                if not entry.is_dir():
+                    continue
+                seen.add(entry.name)
+                try:
+                    # 目录中增删文件会改变目录的修改时间
+                    mtime_ns = entry.stat().st_mtime_ns
+                    cached = books.get(entry.name)
+                    if cached and cached['mtime_ns'] == mtime_ns:
+                        continue
+                    book = scan_book_dir(entry.path)
+                except OSError as e:
+                    print(f"扫描 {entry.name} 失败: {e}")
+                    continue
+                book['mtime_ns'] = mtime_ns
+                books[entry.name] = book
+                changed = True
+
+        for name in set(books) - seen:
+            del books[name]
+            changed = True
+
+        with self.lock:
+            self.books = books
+        if changed:
+            self.save_index()
+
+        result = []
+        for name, book in books.items():
+            result.append(dict(book, path=os.path.join(self.novels_dir, name)))
+        result.sort(key=lambda book: book['mtime_ns'], reverse=True)
+        return result
@@ -8,29 +8,56 @@
 import sys
 import os
 import threading
-from PyQt5.QtWidgets import *
-from PyQt5.QtCore import *
-from PyQt5.QtGui import *
+from PyQt5.QtWidgets import (
+    QApplication, QDesktopWidget, QDoubleSpinBox, QFileDialog, QFormLayout, QGroupBox,
+    QHBoxLayout, QLabel, QLineEdit, QListWidget, QListWidgetItem, QMainWindow, QMessageBox,
+    QPushButton, QSpinBox, QTabWidget, QTextEdit, QVBoxLayout, QWidget
+)
+from PyQt5.QtCore import QFileSystemWatcher, QThread, QTimer, Qt, pyqtSignal
+from PyQt5.QtGui import QIcon
 
-# 导入自定义模块
-from spider import NovelSpider
-from reader import NovelReader
+# 爬虫（requests、bs4、chardet）和阅读器在第一次用到时才导入，窗口可以尽快显示
+from library_index import LibraryIndex
 
 class DownloadWorker(QThread):
     """下载工作线程"""
     progress_updated = pyqtSignal(str)
     download_finished = pyqtSignal(str, bool)
+    # 目录解析完成，可以边下边读: (小说目录, 章节列表)
+    book_ready = pyqtSignal(str, list)
+    chapter_arrived = pyqtSignal(int)
     
-    def __init__(self, novel_id, output_dir):
+    def __init__(self, novel_id, output_dir, governor=None, retry_only=False):
         super().__init__()
         self.novel_id = novel_id
         self.output_dir = output_dir
-        self.spider = NovelSpider(max_workers=3)
+        self.retry_only = retry_only
+        from spider import NovelSpider
+        # 章节存储会额外保存一份压缩副本，设置环境变量 NOVEL_STORE=1 时才开启
+        self.spider = NovelSpider(max_workers=3, governor=governor,
+                                  store=os.environ.get('NOVEL_STORE') == '1')
+        self.novel_info = None
+    
+    def on_progress(self, event):
+        """在下载线程中被调用，通过信号转发给界面"""
+        if event['type'] == 'start' and self.novel_info:
+            self.book_ready.emit(event['novel_dir'], self.novel_info['chapters'])
+        elif event['type'] == 'chapter' and event['ok']:
+            self.chapter_arrived.emit(event['index'])
+    
+    def prioritize(self, indices):
+        """阅读器请求优先下载的章节，可以在界面线程调用"""
+        return self.spider.prioritize(self.novel_id, indices)
     
     def run(self):
         try:
             self.progress_updated.emit(f"开始下载小说 ID: {self.novel_id}")
-            result = self.spider.download_novel(self.novel_id, self.output_dir)
+            if self.retry_only:
+                result = self.spider.retry_failed(self.novel_id, self.output_dir)
+            else:
+                self.novel_info = self.spider.parse_novel_info(self.novel_id)
+                result = self.spider.download_novel(self.novel_id, self.output_dir, self.novel_info,
+                                                    progress_callback=self.on_progress)
             
             if result:
                 self.progress_updated.emit("下载完成！")
@@ -43,11 +70,44 @@ class DownloadWorker(QThread):
             self.progress_updated.emit(f"下载出错: {str(e)}")
             self.download_finished.emit("", False)
 
+class LibraryScanWorker(QThread):
+    """在后台增量扫描下载目录"""
+    scanned = pyqtSignal(list)
+    
+    def __init__(self, library_index):
+        super().__init__()
+        self.library_index = library_index
+    
+    def run(self):
+        try:
+            books = self.library_index.scan(should_stop=self.isInterruptionRequested)
+        except Exception as e:
+            print(f"扫描下载目录失败: {e}")
+            return
+        if books is not None:
+            self.scanned.emit(books)
+
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
         self.reader_window = None
         self.download_worker = None
+        self.downloading_book = None
+        # 所有下载任务共享的限速器，可在运行时调整，第一次下载或调整限速时创建
+        self.governor = None
+        
+        # 最近下载的小说：后台扫描，目录变化时合并通知后再刷新
+        self.novels_dir = "novels"
+        self.library_index = LibraryIndex(self.novels_dir)
+        self.library_worker = None
+        self.library_rescan = False
+        self.library_watcher = QFileSystemWatcher(self)
+        self.library_watcher.directoryChanged.connect(lambda _: self.library_refresh_timer.start())
+        self.library_refresh_timer = QTimer(self)
+        self.library_refresh_timer.setSingleShot(True)
+        self.library_refresh_timer.setInterval(500)
+        self.library_refresh_timer.timeout.connect(self.refresh_recent_novels)
+        
         self.init_ui()
     
     def init_ui(self):
@@ -131,6 +191,50 @@ class MainWindow(QMainWindow):
         
         layout.addWidget(input_group)
         
+        # 限速设置
+        limit_group = QGroupBox("限速设置")
+        limit_layout = QFormLayout(limit_group)
+        
+        self.bandwidth_spin = QSpinBox()
+        self.bandwidth_spin.setRange(0, 100000)
+        self.bandwidth_spin.setSuffix(" KB/s")
+        self.bandwidth_spin.setSpecialValueText("不限")
+        self.bandwidth_spin.valueChanged.connect(self.change_rate_limits)
+        limit_layout.addRow("下载带宽:", self.bandwidth_spin)
+        
+        self.request_rate_spin = QDoubleSpinBox()
+        self.request_rate_spin.setRange(0, 100)
+        self.request_rate_spin.setDecimals(1)
+        self.request_rate_spin.setSingleStep(0.5)
+        self.request_rate_spin.setSuffix(" 次/秒")
+        self.request_rate_spin.setSpecialValueText("不限")
+        self.request_rate_spin.valueChanged.connect(self.change_rate_limits)
+        limit_layout.addRow("请求频率:", self.request_rate_spin)
+        
+        # 单个站点的限速，与全局限速同时生效
+        host_layout = QHBoxLayout()
+        self.host_limit_input = QLineEdit()
+        self.host_limit_input.setPlaceholderText("站点域名，例如 www.577ff.cfd")
+        host_layout.addWidget(self.host_limit_input)
+        self.host_bandwidth_spin = QSpinBox()
+        self.host_bandwidth_spin.setRange(0, 100000)
+        self.host_bandwidth_spin.setSuffix(" KB/s")
+        self.host_bandwidth_spin.setSpecialValueText("不限")
+        host_layout.addWidget(self.host_bandwidth_spin)
+        self.host_request_rate_spin = QDoubleSpinBox()
+        self.host_request_rate_spin.setRange(0, 100)
+        self.host_request_rate_spin.setDecimals(1)
+        self.host_request_rate_spin.setSingleStep(0.5)
+        self.host_request_rate_spin.setSuffix(" 次/秒")
+        self.host_request_rate_spin.setSpecialValueText("不限")
+        host_layout.addWidget(self.host_request_rate_spin)
+        host_limit_btn = QPushButton("应用")
+        host_limit_btn.clicked.connect(self.change_host_limits)
+        host_layout.addWidget(host_limit_btn)
+        limit_layout.addRow("站点限速:", host_layout)
+        
+        layout.addWidget(limit_group)
+        
         # 下载按钮
         button_layout = QHBoxLayout()
         
@@ -173,8 +277,19 @@ class MainWindow(QMainWindow):
         self.stop_btn.clicked.connect(self.stop_download)
         self.stop_btn.setEnabled(False)
         
+        self.retry_btn = QPushButton("重试失败章节")
+        self.retry_btn.setToolTip("只重新下载上次失败的章节，不重新遍历全部章节")
+        self.retry_btn.clicked.connect(self.retry_failed)
+        
+        self.read_now_btn = QPushButton("边下边读")
+        self.read_now_btn.setToolTip("打开正在下载的小说，正在阅读的章节会优先下载")
+        self.read_now_btn.clicked.connect(self.read_while_downloading)
+        self.read_now_btn.setEnabled(False)
+        
         button_layout.addWidget(self.download_btn)
         button_layout.addWidget(self.stop_btn)
+        button_layout.addWidget(self.retry_btn)
+        button_layout.addWidget(self.read_now_btn)
         button_layout.addStretch()
         
         layout.addLayout(button_layout)
@@ -291,8 +406,8 @@ class MainWindow(QMainWindow):
         
         self.tab_widget.addTab(reader_widget, "小说阅读")
         
-        # 初始化时刷新最近小说列表
-        self.refresh_recent_novels()
+        # 窗口显示后再扫描最近小说列表
+        QTimer.singleShot(0, self.refresh_recent_novels)
     
     def create_help_tab(self):
         help_widget = QWidget()
@@ -371,7 +486,10 @@ class MainWindow(QMainWindow):
         if dir_path:
             self.output_dir_input.setText(dir_path)
     
-    def start_download(self):
+    def retry_failed(self):
+        self.start_download(retry_only=True)
+    
+    def start_download(self, retry_only=False):
         novel_id = self.novel_id_input.text().strip()
         if not novel_id:
             QMessageBox.warning(self, "警告", "请输入小说ID")
@@ -387,25 +505,78 @@ class MainWindow(QMainWindow):
         self.progress_text.clear()
         
         # 创建下载线程
-        self.download_worker = DownloadWorker(novel_id, output_dir)
+        self.download_worker = DownloadWorker(novel_id, output_dir, self.get_governor(), retry_only)
         self.download_worker.progress_updated.connect(self.update_progress)
         self.download_worker.download_finished.connect(self.download_completed)
+        self.download_worker.book_ready.connect(self.on_book_ready)
+        self.downloading_book = None
         
         # 更新按钮状态
         self.download_btn.setEnabled(False)
+        self.retry_btn.setEnabled(False)
         self.stop_btn.setEnabled(True)
         
         # 开始下载
         self.download_worker.start()
         self.status_bar.showMessage("正在下载...")
     
+    def on_book_ready(self, novel_dir, chapters):
+        self.downloading_book = (novel_dir, chapters)
+        self.read_now_btn.setEnabled(True)
+    
+    def read_while_downloading(self):
+        """在阅读器中打开正在下载的小说"""
+        worker = self.download_worker
+        if not worker or not worker.isRunning() or not self.downloading_book:
+            return
+        self.open_reader()
+        novel_dir, chapters = self.downloading_book
+        self.reader_window.attach_download(novel_dir, chapters, worker.prioritize)
+        worker.chapter_arrived.connect(self.reader_window.on_chapter_downloaded)
+    
+    def end_read_while_downloading(self):
+        self.downloading_book = None
+        self.read_now_btn.setEnabled(False)
+        if self.reader_window:
+            self.reader_window.detach_download()
+    
+    def get_governor(self):
+        if self.governor is None:
+            from spider import RateGovernor
+            self.governor = RateGovernor()
+        return self.governor
+    
+    def change_rate_limits(self):
+        """调整限速，正在进行的下载立即生效"""
+        self.get_governor().set_global_limits(
+            bytes_per_sec=self.bandwidth_spin.value() * 1024,
+            requests_per_sec=self.request_rate_spin.value()
+        )
+        self.status_bar.showMessage("限速设置已更新")
+    
+    def change_host_limits(self):
+        """设置单个站点的限速，两项都为不限时移除该站点的限制"""
+        host = self.host_limit_input.text().strip()
+        if not host:
+            QMessageBox.warning(self, "警告", "请输入站点域名")
+            return
+        bytes_per_sec = self.host_bandwidth_spin.value() * 1024
+        requests_per_sec = self.host_request_rate_spin.value()
+        self.get_governor().set_host_limits(host, bytes_per_sec, requests_per_sec)
+        if bytes_per_sec or requests_per_sec:
+            self.status_bar.showMessage(f"已设置 {host} 的限速")
+        else:
+            self.status_bar.showMessage(f"已取消 {host} 的限速")
+    
     def stop_download(self):
         if self.download_worker and self.download_worker.isRunning():
             self.download_worker.terminate()
             self.download_worker.wait()
             
             self.progress_text.append("下载已停止")
+            self.end_read_while_downloading()
             self.download_btn.setEnabled(True)
+            self.retry_btn.setEnabled(True)
             self.stop_btn.setEnabled(False)
             self.status_bar.showMessage("下载已停止")
     
@@ -416,7 +587,9 @@ class MainWindow(QMainWindow):
         scrollbar.setValue(scrollbar.maximum())
     
     def download_completed(self, result_path, success):
+        self.end_read_while_downloading()
         self.download_btn.setEnabled(True)
+        self.retry_btn.setEnabled(True)
         self.stop_btn.setEnabled(False)
         
         if success:
@@ -440,6 +613,7 @@ class MainWindow(QMainWindow):
     
     def open_reader(self):
         if self.reader_window is None:
+            from reader import NovelReader
             self.reader_window = NovelReader()
         
         self.reader_window.show()
@@ -478,20 +652,34 @@ class MainWindow(QMainWindow):
             self.open_reader_with_book(dir_path)
     
     def refresh_recent_novels(self):
+        """在后台线程中扫描下载目录，扫描进行中再次刷新时等本次结束后补扫一次"""
+        if os.path.isdir(self.novels_dir) and self.novels_dir not in self.library_watcher.directories():
+            self.library_watcher.addPath(self.novels_dir)
+        if self.library_worker and self.library_worker.isRunning():
+            self.library_rescan = True
+            return
+        self.library_rescan = False
+        self.library_worker = LibraryScanWorker(self.library_index)
+        self.library_worker.scanned.connect(self.on_library_scanned)
+        self.library_worker.finished.connect(self.on_library_scan_finished)
+        self.library_worker.start()
+    
+    def on_library_scanned(self, books):
+        self.recent_novels_list.setUpdatesEnabled(False)
         self.recent_novels_list.clear()
-        
-        novels_dir = "novels"
-        if os.path.exists(novels_dir):
-            for item in os.listdir(novels_dir):
-                item_path = os.path.join(novels_dir, item)
-                if os.path.isdir(item_path):
-                    # 查找完整版文件
-                    complete_files = [f for f in os.listdir(item_path) if f.endswith('_完整版.txt')]
-                    if complete_files:
-                        novel_name = complete_files[0].replace('_完整版.txt', '')
-                        list_item = QListWidgetItem(novel_name)
-                        list_item.setData(Qt.UserRole, item_path)
-                        self.recent_novels_list.addItem(list_item)
+        for book in books:
+            # 只列出已合并出完整版的小说
+            if not book['merged_file']:
+                continue
+            list_item = QListWidgetItem(book['title'])
+            list_item.setData(Qt.UserRole, book['path'])
+            list_item.setToolTip(f"{book['chapters']} 章，{book['size'] / 1024 / 1024:.1f} MB")
+            self.recent_novels_list.addItem(list_item)
+        self.recent_novels_list.setUpdatesEnabled(True)
+    
+    def on_library_scan_finished(self):
+        if self.library_rescan:
+            self.refresh_recent_novels()
     
     def open_recent_novel(self, item):
         book_path = item.data(Qt.UserRole)
@@ -503,6 +691,10 @@ class MainWindow(QMainWindow):
         if self.reader_window:
             self.reader_window.close()
         
+        if self.library_worker and self.library_worker.isRunning():
+            self.library_worker.requestInterruption()
+            self.library_worker.wait()
+        
         # 停止下载线程
         if self.download_worker and self.download_worker.isRunning():
             self.download_worker.terminate()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+代理池
+每个代理使用独立的 requests.Session 和连接池，按成功率和延迟持续打分，
+按分数分配请求，连续失败的代理进入隔离期
+"""
+
+import time
+import random
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+# 这些状态码通常表示代理 IP 被限流或封禁，计为代理失败
+PROXY_FAILURE_STATUS = {403, 407, 429, 502, 503, 504}
+
+class ProxyState:
+    """单个代理的会话和健康状况"""
+    def __init__(self, proxy, headers=None, pool_size=10):
+        self.proxy = proxy
+        self.session = requests.Session()
+        if headers:
+            self.session.headers.update(headers)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.proxies = {'http': proxy, 'https': proxy}
+
+        self.success_rate = 1.0
+        self.latency = None
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.quarantine_count = 0
+        self.quarantined_until = 0
+
+    def score(self, default_latency=1.0):
+        """成功率越高、延迟越低分数越高"""
+        latency = self.latency if self.latency is not None else default_latency
+        return max(self.success_rate, 0.01) ** 2 / max(latency, 0.05)
+
+    def to_dict(self):
+        return {
+            'proxy': self.proxy,
+            'score': round(self.score(), 3),
+            'success_rate': round(self.success_rate, 3),
+            'latency': round(self.latency, 3) if self.latency is not None else None,
+            'requests': self.requests,
+            'failures': self.failures,
+            'quarantined': self.quarantined_until > time.time()
+        }
+
+class ProxyPool:
+    """按分数加权随机选择代理，连续失败的代理被隔离，隔离时间逐次翻倍"""
+    def __init__(self, proxies, headers=None, pool_size=10, alpha=0.2,
+                 max_failures=3, quarantine=60, max_quarantine=600):
+        if not proxies:
+            raise ValueError("代理列表不能为空")
+        self.states = [ProxyState(proxy, headers, pool_size) for proxy in proxies]
+        self.alpha = alpha
+        self.max_failures = max_failures
+        self.quarantine = quarantine
+        self.max_quarantine = max_quarantine
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """选择一个代理；全部被隔离时提前放出最快解除隔离的一个"""
+        now = time.time()
+        with self.lock:
+            available = [state for state in self.states if state.quarantined_until <= now]
+            if not available:
+                state = min(self.states, key=lambda s: s.quarantined_until)
+                state.quarantined_until = 0
+                return state
+
+            latencies = [state.latency for state in available if state.latency is not None]
+            default_latency = sum(latencies) / len(latencies) if latencies else 1.0
+            weights = [state.score(default_latency) for state in available]
+            return random.choices(available, weights=weights)[0]
+
+    def report(self, state, ok, latency=None):
+        """上报一次请求的结果，更新代理分数"""
+        with self.lock:
+            state.requests += 1
+            state.success_rate += self.alpha * ((1.0 if ok else 0.0) - state.success_rate)
+            if ok:
+                state.consecutive_failures = 0
+                if latency is not None:
+                    state.latency = latency if state.latency is None else \
+                        state.latency + self.alpha * (latency - state.latency)
+                return
+
+            state.failures += 1
+            state.consecutive_failures += 1
+            if state.consecutive_failures >= self.max_failures:
+                state.quarantine_count += 1
+                duration = min(self.max_quarantine, self.quarantine * 2 ** (state.quarantine_count - 1))
+                state.quarantined_until = time.time() + duration
+                # 解除隔离后再失败一次就重新隔离
+                state.consecutive_failures = self.max_failures - 1
+                print(f"代理 {state.proxy} 连续失败，隔离 {duration:.0f} 秒")
+
+    def stats(self):
+        with self.lock:
+            return [state.to_dict() for state in self.states]
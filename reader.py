@@ -8,93 +8,381 @@
 import sys
 import os
 import json
-import re
+import mmap
+import bisect
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from PyQt5.QtWidgets import *
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 
+import book_index
+from library import LibraryDB
+from search_index import SearchIndex
+from text_encoding import EncodingCache
+
 class BookmarkManager:
-    """书签管理器"""
-    def __init__(self, config_dir):
-        self.config_dir = config_dir
-        self.bookmark_file = os.path.join(config_dir, "bookmarks.json")
-        self.bookmarks = self.load_bookmarks()
-    
-    def load_bookmarks(self):
-        try:
-            if os.path.exists(self.bookmark_file):
-                with open(self.bookmark_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-        except Exception as e:
-            print(f"加载书签失败: {e}")
-        return {}
-    
-    def save_bookmarks(self):
-        try:
-            os.makedirs(self.config_dir, exist_ok=True)
-            with open(self.bookmark_file, 'w', encoding='utf-8') as f:
-                json.dump(self.bookmarks, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"保存书签失败: {e}")
+    """书签管理器，数据保存在书库数据库中"""
+    def __init__(self, library):
+        self.library = library
     
     def add_bookmark(self, book_path, chapter_index, position, note=""):
-        if book_path not in self.bookmarks:
-            self.bookmarks[book_path] = []
-        
-        bookmark = {
-            'chapter_index': chapter_index,
-            'position': position,
-            'note': note,
-            'created_time': datetime.now().isoformat()
-        }
-        
-        self.bookmarks[book_path].append(bookmark)
-        self.save_bookmarks()
+        self.library.add_bookmark(book_path, chapter_index, position, note)
     
     def get_bookmarks(self, book_path):
-        return self.bookmarks.get(book_path, [])
+        return self.library.get_bookmarks(book_path)
     
     def remove_bookmark(self, book_path, index):
-        if book_path in self.bookmarks and 0 <= index < len(self.bookmarks[book_path]):
-            del self.bookmarks[book_path][index]
-            self.save_bookmarks()
+        bookmarks = self.get_bookmarks(book_path)
+        if 0 <= index < len(bookmarks):
+            self.library.remove_bookmark(bookmarks[index]['id'])
 
 class ReadingStats:
-    """阅读统计"""
-    def __init__(self, config_dir):
-        self.config_dir = config_dir
-        self.stats_file = os.path.join(config_dir, "reading_stats.json")
-        self.stats = self.load_stats()
+    """阅读统计，每次打开书籍记为一次阅读会话"""
+    def __init__(self, library):
+        self.library = library
         self.session_start = datetime.now()
+        self.session_book = None
+        self.session_id = None
+    
+    def update_reading_time(self, book_path, minutes):
+        if book_path != self.session_book:
+            self.session_book = book_path
+            self.session_id = self.library.start_session(book_path)
+        self.library.add_session_time(self.session_id, minutes)
+    
+    def get_stats(self, book_path):
+        return self.library.get_stats(book_path)
+
+class StateWriter:
+    """配置文件的后台写入器：短时间内的多次修改合并为一次，延迟后在后台线程原子写入"""
+    def __init__(self, path, delay=1.0):
+        self.path = path
+        self.delay = delay
+        self.pending = None
+        self.timer = None
+        self.lock = threading.Lock()
+        # 保证同一时间只有一个线程在写文件
+        self.write_lock = threading.Lock()
+    
+    def schedule(self, data):
+        """记下最新状态；第一次修改 delay 秒后写盘，期间的修改合并为一次写入"""
+        with self.lock:
+            self.pending = dict(data)
+            if self.timer is None:
+                self.timer = threading.Timer(self.delay, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+    
+    def flush(self):
+        """立即写出尚未保存的状态，关闭窗口时在界面线程调用
+
+        先取得 write_lock 再取出状态：计时器线程正在写盘时会等它写完，
+        返回时最新状态一定已经写出，也不会出现旧状态覆盖新状态
+        """
+        with self.write_lock:
+            with self.lock:
+                data = self.pending
+                self.pending = None
+                if self.timer is not None:
+                    self.timer.cancel()
+                    self.timer = None
+            if data is None:
+                return
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                tmp_file = self.path + ".tmp"
+                with open(tmp_file, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False, indent=2)
+                os.replace(tmp_file, self.path)
+            except Exception as e:
+                print(f"保存配置失败: {e}")
+
+class ChapterCache:
+    """章节正文的 LRU 缓存，总大小超过内存预算时淘汰最久未读的章节"""
+    def __init__(self, budget_mb=16):
+        self.budget = budget_mb * 1024 * 1024
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        # 单线程在后台预读相邻章节
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = set()
+    
+    def get(self, key, loader):
+        """返回缓存的正文，未命中时调用 loader() 读取并放入缓存"""
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+        content = loader()
+        self.put(key, content)
+        return content
+    
+    def put(self, key, content):
+        size = sys.getsizeof(content)
+        with self.lock:
+            if key in self.entries:
+                self.size -= sys.getsizeof(self.entries.pop(key))
+            self.entries[key] = content
+            self.size += size
+            # 至少保留刚放入的章节
+            while self.size > self.budget and len(self.entries) > 1:
+                _, old = self.entries.popitem(last=False)
+                self.size -= sys.getsizeof(old)
+    
+    def prefetch(self, key, loader):
+        """在后台读取章节放入缓存，已缓存或正在读取时跳过"""
+        with self.lock:
+            if key in self.entries or key in self.pending:
+                return
+            self.pending.add(key)
+        
+        def load():
+            try:
+                content = loader()
+                with self.lock:
+                    cached = key in self.entries
+                if not cached:
+                    self.put(key, content)
+            except Exception as e:
+                print(f"预读章节失败: {e}")
+            finally:
+                with self.lock:
+                    self.pending.discard(key)
+        self.executor.submit(load)
+    
+    def discard(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.size -= sys.getsizeof(self.entries.pop(key))
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+class ChapterListModel(QAbstractListModel):
+    """章节列表模型：文字在视图需要时才生成，不为每章创建列表项
+
+    rows 为筛选后可见章节的序号（升序），未筛选时为 None，表示全部章节
+    """
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.chapters = []
+        self.rows = None
+        self.filter_text = ""
+    
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.chapters) if self.rows is None else len(self.rows)
+    
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        chapter_index = index.row() if self.rows is None else self.rows[index.row()]
+        chapter = self.chapters[chapter_index]
+        if role == Qt.DisplayRole:
+            suffix = "" if chapter.get('available', True) else "（下载中）"
+            return f"{chapter_index + 1}. {chapter['title']}{suffix}"
+        if role == Qt.UserRole:
+            return chapter_index
+        if role == Qt.ForegroundRole and not chapter.get('available', True):
+            return QBrush(QColor('#999999'))
+        return None
+    
+    def set_chapters(self, chapters):
+        self.beginResetModel()
+        self.chapters = chapters
+        self.rows = self.filter_rows(self.filter_text)
+        self.endResetModel()
+    
+    def append_chapters(self, chapters):
+        """在末尾追加章节，只通知新增的行，已显示的行不重新生成"""
+        start = len(self.chapters)
+        if self.rows is None:
+            rows = list(range(start, start + len(chapters)))
+            first = start
+        else:
+            rows = [start + i for i, chapter in enumerate(chapters) if self.filter_text in chapter['title']]
+            first = len(self.rows)
+        if rows:
+            self.beginInsertRows(QModelIndex(), first, first + len(rows) - 1)
+        self.chapters.extend(chapters)
+        if self.rows is not None:
+            self.rows.extend(rows)
+        if rows:
+            self.endInsertRows()
     
-    def load_stats(self):
+    def filter_rows(self, text):
+        if not text:
+            return None
+        return [i for i, chapter in enumerate(self.chapters) if text in chapter['title']]
+    
+    def set_filter(self, text):
+        text = text.strip()
+        if text == self.filter_text:
+            return
+        self.beginResetModel()
+        self.filter_text = text
+        self.rows = self.filter_rows(text)
+        self.endResetModel()
+    
+    def row_of(self, chapter_index):
+        """章节在当前列表中的行号，被筛选掉时返回 -1"""
+        if self.rows is None:
+            return chapter_index if 0 <= chapter_index < len(self.chapters) else -1
+        row = bisect.bisect_left(self.rows, chapter_index)
+        return row if row < len(self.rows) and self.rows[row] == chapter_index else -1
+    
+    def chapter_changed(self, chapter_index):
+        row = self.row_of(chapter_index)
+        if row >= 0:
+            model_index = self.index(row)
+            self.dataChanged.emit(model_index, model_index)
+
+class RenderCache:
+    """已排版章节文档的缓存，保存当前章节和前后章节
+
+    文档记录排版时使用的字体设置（render_style），与当前设置不同的文档在使用前重新排版
+    """
+    def __init__(self, capacity=3):
+        self.capacity = capacity
+        self.documents = OrderedDict()
+    
+    def get(self, index):
+        document = self.documents.get(index)
+        if document is not None:
+            self.documents.move_to_end(index)
+        return document
+    
+    def put(self, index, document, keep=()):
+        """放入文档，超出容量时淘汰最久未用且不在 keep 中的文档"""
+        old = self.documents.pop(index, None)
+        if old is not None and old is not document:
+            old.deleteLater()
+        self.documents[index] = document
+        for key in list(self.documents):
+            if len(self.documents) <= self.capacity:
+                break
+            if key not in keep and key != index:
+                self.documents.pop(key).deleteLater()
+    
+    def discard(self, index):
+        """丢弃单个章节的文档，调用方须确认它不是正在显示的文档"""
+        document = self.documents.pop(index, None)
+        if document is not None:
+            document.deleteLater()
+    
+    def clear(self):
+        for document in self.documents.values():
+            document.deleteLater()
+        self.documents.clear()
+
+class PageLayoutCache:
+    """分页结果缓存：每章各页的起始纵坐标，按字体设置和视口大小区分，同时保存在磁盘上"""
+    def __init__(self, cache_dir, max_layouts=4):
+        self.cache_dir = cache_dir
+        self.max_layouts = max_layouts
+        self.pages = {}
+        self.writer = None
+    
+    def open_book(self, book_path):
+        self.flush()
+        key = hashlib.sha1(os.path.abspath(book_path).encode('utf-8')).hexdigest()
+        path = os.path.join(self.cache_dir, key + ".json")
+        self.pages = {}
         try:
-            if os.path.exists(self.stats_file):
-                with open(self.stats_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+            if os.path.exists(path):
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.pages = json.load(f)
         except Exception as e:
-            print(f"加载统计失败: {e}")
-        return {}
+            print(f"加载分页缓存失败: {e}")
+        self.writer = StateWriter(path, delay=2.0)
+    
+    def get(self, layout_key, chapter_key):
+        return self.pages.get(layout_key, {}).get(chapter_key)
+    
+    def put(self, layout_key, chapter_key, starts):
+        if layout_key not in self.pages:
+            # 只保留最近几种字体/窗口大小的分页结果
+            while len(self.pages) >= self.max_layouts:
+                self.pages.pop(next(iter(self.pages)))
+            self.pages[layout_key] = {}
+        self.pages[layout_key][chapter_key] = starts
+        if self.writer:
+            self.writer.schedule({key: dict(value) for key, value in self.pages.items()})
+    
+    def flush(self):
+        if self.writer:
+            self.writer.flush()
+
+class ReaderTextEdit(QTextEdit):
+    """正文显示控件：分页模式下滚轮翻页，并遮住页面底部属于下一页的行"""
+    page_requested = pyqtSignal(int)
+    resized = pyqtSignal()
+    
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.paged = False
+        self.page_mask = 0
+    
+    def set_page_mask(self, height):
+        if height != self.page_mask:
+            self.page_mask = height
+            self.setViewportMargins(0, 0, 0, height)
     
-    def save_stats(self):
+    def page_height(self):
+        return self.viewport().height() + self.page_mask
+    
+    def wheelEvent(self, event):
+        if self.paged:
+            delta = event.angleDelta().y()
+            if delta:
+                self.page_requested.emit(-1 if delta > 0 else 1)
+            event.accept()
+            return
+        super().wheelEvent(event)
+    
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.resized.emit()
+
+class SearchWorker(QThread):
+    """后台更新全文索引并搜索，命中结果逐条通过信号送回界面；query 为 None 时只更新索引"""
+    hit_found = pyqtSignal(int, int, str)
+    search_finished = pyqtSignal(int, bool)
+    
+    def __init__(self, index, chapters, read_text, query=None, parent=None):
+        super().__init__(parent)
+        self.index = index
+        self.chapters = list(chapters)
+        self.read_text = read_text
+        self.query = query
+    
+    def run(self):
+        stop = self.isInterruptionRequested
         try:
-            os.makedirs(self.config_dir, exist_ok=True)
-            with open(self.stats_file, 'w', encoding='utf-8') as f:
-                json.dump(self.stats, f, ensure_ascii=False, indent=2)
+            self.index.update(self.chapters, self.read_text, should_stop=stop)
+            self.index.save_index()
         except Exception as e:
-            print(f"保存统计失败: {e}")
-    
-    def update_reading_time(self, book_path, minutes):
-        if book_path not in self.stats:
-            self.stats[book_path] = {'total_time': 0, 'sessions': 0}
+            print(f"更新搜索索引失败: {e}")
+        if self.query is None or stop():
+            return
         
-        self.stats[book_path]['total_time'] += minutes
-        self.stats[book_path]['sessions'] += 1
-        self.save_stats()
-    
-    def get_stats(self, book_path):
-        return self.stats.get(book_path, {'total_time': 0, 'sessions': 0})
+        hits = 0
+        try:
+            for chapter_index, position, snippet in self.index.search(
+                    self.query, self.chapters, self.read_text, should_stop=stop):
+                self.hit_found.emit(chapter_index, position, snippet)
+                hits += 1
+        except Exception as e:
+            print(f"搜索失败: {e}")
+        self.search_finished.emit(hits, stop())
 
 class NovelReader(QMainWindow):
     def __init__(self):
@@ -103,8 +391,10 @@ class NovelReader(QMainWindow):
         self.config_file = os.path.join(self.config_dir, "config.json")
         
         # 初始化组件
-        self.bookmark_manager = BookmarkManager(self.config_dir)
-        self.reading_stats = ReadingStats(self.config_dir)
+        self.library = LibraryDB(self.config_dir)
+        self.encodings = EncodingCache(os.path.join(self.config_dir, "index"))
+        self.bookmark_manager = BookmarkManager(self.library)
+        self.reading_stats = ReadingStats(self.library)
         
         # 阅读状态
         self.current_book = None
@@ -112,12 +402,78 @@ class NovelReader(QMainWindow):
         self.current_chapter_index = 0
         self.current_position = 0
         
+        # 边下边读：向下载线程请求优先下载章节的回调，未在下载时为 None
+        self.download_prioritize = None
+        self.download_rows = {}
+        
+        # 全文搜索
+        self.search_index = None
+        self.search_worker = None
+        self.search_query = ""
+        
+        # 当前完整版文件的内存映射
+        self.book_file = None
+        self.book_map = None
+        self.book_map_path = None
+        self.book_encoding = 'utf-8'
+        
+        # 跟随正在写入的书籍：监视打开的章节文件夹或完整版文件，变化合并后每半秒处理一次
+        self.book_watcher = QFileSystemWatcher(self)
+        self.book_watcher.directoryChanged.connect(self.on_book_changed)
+        self.book_watcher.fileChanged.connect(self.on_book_changed)
+        self.known_chapter_files = set()
+        self.book_stat = None
+        # 完整版文件已建立目录部分的大小和哈希，用于确认文件只是在末尾追加
+        self.book_size = 0
+        self.book_hash = None
+        
         # 加载配置
         self.config = self.load_config()
+        self.state_writer = StateWriter(self.config_file)
+        self.chapter_cache = ChapterCache(self.config['chapter_cache_mb'])
+        self.render_cache = RenderCache()
+        self.placeholder_document = None
+        
+        # 分页模式
+        self.page_cache = PageLayoutCache(os.path.join(self.config_dir, "pages"))
+        self.page_starts = []
+        self.current_page = 0
+        self.pending_page = 0
+        
+        # 连续滚动模式：文档中只保留当前章节前后若干章
+        self.continuous_document = None
+        self.window_first = 0
+        self.window_lengths = []
+        self.window_title_lengths = []
+        self.adjusting_window = False
+        
+        # 阅读位置在停止翻页/滚动一秒后保存
+        self.position_timer = QTimer(self)
+        self.position_timer.setSingleShot(True)
+        self.position_timer.setInterval(1000)
+        self.position_timer.timeout.connect(self.save_position)
         
         # 初始化界面
         self.init_ui()
         self.apply_theme()
+        self.apply_font_settings()
+        self.apply_reading_mode()
+        
+        self.tail_timer = QTimer(self)
+        self.tail_timer.setSingleShot(True)
+        self.tail_timer.setInterval(500)
+        self.tail_timer.timeout.connect(self.refresh_book_tail)
+        # 新章节停止增加几秒后再更新全文索引
+        self.tail_index_timer = QTimer(self)
+        self.tail_index_timer.setSingleShot(True)
+        self.tail_index_timer.setInterval(5000)
+        self.tail_index_timer.timeout.connect(self.update_tail_index)
+        
+        # 窗口大小变化停止后重新分页
+        self.repaginate_timer = QTimer(self)
+        self.repaginate_timer.setSingleShot(True)
+        self.repaginate_timer.setInterval(200)
+        self.repaginate_timer.timeout.connect(self.repaginate)
         
         # 定时器用于统计阅读时间
         self.reading_timer = QTimer()
@@ -132,8 +488,10 @@ class NovelReader(QMainWindow):
             'theme': 'light',
             'window_geometry': None,
             'last_book': None,
-            'last_chapter': 0,
-            'last_position': 0
+            'download_prefetch': 3,
+            'reading_mode': 'scroll',
+            'continuous_window': 2,
+            'chapter_cache_mb': 16
         }
         
         try:
@@ -147,12 +505,8 @@ class NovelReader(QMainWindow):
         return default_config
     
     def save_config(self):
-        try:
-            os.makedirs(self.config_dir, exist_ok=True)
-            with open(self.config_file, 'w', encoding='utf-8') as f:
-                json.dump(self.config, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"保存配置失败: {e}")
+        """交给后台写入器，不在界面线程等待磁盘"""
+        self.state_writer.schedule(self.config)
     
     def init_ui(self):
         self.setWindowTitle("笔趣阁小说阅读器")
@@ -189,17 +543,53 @@ class NovelReader(QMainWindow):
         # 创建状态栏
         self.create_status_bar()
         
+        # 搜索结果面板
+        self.create_search_dock()
+        
         # 设置快捷键
         self.setup_shortcuts()
     
+    def create_search_dock(self):
+        self.search_dock = QDockWidget("搜索结果", self)
+        self.search_dock.setObjectName("search_dock")
+        dock_widget = QWidget()
+        dock_layout = QVBoxLayout(dock_widget)
+        
+        self.search_status = QLabel("")
+        dock_layout.addWidget(self.search_status)
+        
+        self.search_results = QListWidget()
+        self.search_results.itemClicked.connect(self.on_search_result_selected)
+        dock_layout.addWidget(self.search_results)
+        
+        self.search_dock.setWidget(dock_widget)
+        self.addDockWidget(Qt.BottomDockWidgetArea, self.search_dock)
+        self.search_dock.hide()
+    
     def create_sidebar(self):
         self.sidebar = QWidget()
         sidebar_layout = QVBoxLayout(self.sidebar)
         
         # 章节列表
         sidebar_layout.addWidget(QLabel("章节列表"))
-        self.chapter_list = QListWidget()
-        self.chapter_list.itemClicked.connect(self.on_chapter_selected)
+        self.chapter_filter = QLineEdit()
+        self.chapter_filter.setPlaceholderText("搜索章节标题")
+        self.chapter_filter.setClearButtonEnabled(True)
+        sidebar_layout.addWidget(self.chapter_filter)
+        
+        # 输入停顿后再筛选，避免每个字符都遍历全部章节
+        self.chapter_filter_timer = QTimer(self)
+        self.chapter_filter_timer.setSingleShot(True)
+        self.chapter_filter_timer.setInterval(200)
+        self.chapter_filter_timer.timeout.connect(self.apply_chapter_filter)
+        self.chapter_filter.textChanged.connect(self.chapter_filter_timer.start)
+        
+        self.chapter_model = ChapterListModel(self)
+        self.chapter_list = QListView()
+        self.chapter_list.setModel(self.chapter_model)
+        self.chapter_list.setUniformItemSizes(True)
+        self.chapter_list.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.chapter_list.clicked.connect(self.on_chapter_selected)
         sidebar_layout.addWidget(self.chapter_list)
         
         # 书签列表
@@ -229,9 +619,11 @@ class NovelReader(QMainWindow):
         reading_layout.addWidget(self.chapter_title)
         
         # 文本显示区域
-        self.text_display = QTextEdit()
+        self.text_display = ReaderTextEdit()
         self.text_display.setReadOnly(True)
         self.text_display.verticalScrollBar().valueChanged.connect(self.on_scroll_changed)
+        self.text_display.page_requested.connect(self.turn_page)
+        self.text_display.resized.connect(self.on_reading_area_resized)
         reading_layout.addWidget(self.text_display)
         
         # 导航按钮
@@ -277,6 +669,21 @@ class NovelReader(QMainWindow):
         # 视图菜单
         view_menu = menubar.addMenu('视图')
         
+        self.paged_action = QAction('分页模式', self)
+        self.paged_action.setCheckable(True)
+        self.paged_action.setShortcut('Ctrl+P')
+        self.paged_action.setChecked(self.config['reading_mode'] == 'page')
+        self.paged_action.toggled.connect(lambda checked: self.set_reading_mode('page' if checked else 'scroll'))
+        view_menu.addAction(self.paged_action)
+        
+        self.continuous_action = QAction('连续滚动', self)
+        self.continuous_action.setCheckable(True)
+        self.continuous_action.setShortcut('Ctrl+L')
+        self.continuous_action.setChecked(self.config['reading_mode'] == 'continuous')
+        self.continuous_action.toggled.connect(
+            lambda checked: self.set_reading_mode('continuous' if checked else 'scroll'))
+        view_menu.addAction(self.continuous_action)
+        
         fullscreen_action = QAction('全屏模式', self)
         fullscreen_action.setShortcut('F11')
         fullscreen_action.triggered.connect(self.toggle_fullscreen)
@@ -406,7 +813,19 @@ class NovelReader(QMainWindow):
         if dir_path:
             self.load_book(dir_path)
     
+    def restore_last_book(self):
+        """如果有上次打开的书籍，自动加载"""
+        if self.config['last_book'] and os.path.exists(self.config['last_book']):
+            self.load_book(self.config['last_book'])
+    
     def load_book(self, file_path):
+        self.unwatch_book()
+        self.page_cache.open_book(file_path)
+        self.stop_search_worker()
+        self.detach_download()
+        self.chapter_cache.clear()
+        self.reset_render_cache()
+        self.close_book_map()
         try:
             # 检查是否是合并文件还是章节文件夹
             if os.path.isfile(file_path):
@@ -417,12 +836,17 @@ class NovelReader(QMainWindow):
             self.current_book = file_path
             self.config['last_book'] = file_path
             self.save_config()
+            self.open_search_index(file_path)
+            self.watch_book(file_path)
+            
+            self.library.touch_book(file_path)
             
-            # 恢复上次阅读位置
-            if self.config['last_chapter'] < len(self.chapters):
-                self.current_chapter_index = self.config['last_chapter']
+            # 恢复这本书上次的阅读位置
+            chapter_index, position = self.library.get_position(file_path) or (0, 0)
+            if chapter_index < len(self.chapters):
+                self.current_chapter_index = chapter_index
                 self.display_chapter()
-                self.text_display.verticalScrollBar().setValue(self.config['last_position'])
+                self.restore_position(position)
             
             self.update_bookmark_list()
             
@@ -430,81 +854,703 @@ class NovelReader(QMainWindow):
             QMessageBox.critical(self, "错误", f"加载小说失败: {e}")
     
     def load_merged_book(self, file_path):
-        """加载合并的小说文件"""
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        # 按分隔符分割章节
-        chapter_parts = re.split(r'={50,}', content)
-        
-        self.chapters = []
-        for i, part in enumerate(chapter_parts):
-            part = part.strip()
-            if part:
-                lines = part.split('\n')
-                title = lines[0].strip() if lines else f"第{i+1}章"
-                content = '\n'.join(lines[1:]).strip() if len(lines) > 1 else part
-                
-                self.chapters.append({
-                    'title': title,
-                    'content': content
-                })
-        
+        """加载合并的小说文件：通过 mmap 映射文件，按章节清单只解码正在阅读的章节
+
+        清单由爬虫生成，没有时扫描一遍分隔线生成并保存，之后再打开只需读取清单。
+        从别处导入的 GBK 等编码的文件按缓存的编码判断解码，UTF-16 文件读取转码后的副本
+        """
+        read_path, self.book_encoding = self.encodings.resolve(file_path)
+        manifest = book_index.load_or_build_manifest(read_path, os.path.join(self.config_dir, "index"),
+                                                     self.book_encoding)
+        self.open_book_map(read_path)
+        self.book_stat = os.stat(file_path)
+        self.book_size = manifest['size']
+        self.book_hash = manifest['sha1']
+        self.chapters = [{
+            'title': chapter['title'],
+            'file': read_path,
+            'offset': chapter['offset'],
+            'length': chapter['length']
+        } for chapter in manifest['chapters']]
         self.update_chapter_list()
     
+    def open_book_map(self, file_path):
+        self.close_book_map()
+        if os.path.getsize(file_path) == 0:
+            return
+        self.book_file = open(file_path, 'rb')
+        self.book_map = mmap.mmap(self.book_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.book_map_path = file_path
+    
+    def close_book_map(self):
+        """关闭映射，打开其他书籍或关闭窗口时调用，避免文件一直被占用"""
+        if self.book_map is not None:
+            self.book_map.close()
+            self.book_file.close()
+        self.book_map = None
+        self.book_file = None
+        self.book_map_path = None
+    
     def load_chapter_book(self, dir_path):
-        """加载章节文件夹"""
-        chapter_files = [f for f in os.listdir(dir_path) if f.endswith('.txt') and not f.endswith('_完整版.txt')]
+        """加载章节文件夹，只按文件名建立目录，正文在阅读时读取"""
+        chapter_files = self.list_chapter_files(dir_path)
         chapter_files.sort(key=lambda x: int(x.split('_')[0]))
         
+        self.chapters = [self.chapter_from_file(dir_path, chapter_file) for chapter_file in chapter_files]
+        self.known_chapter_files = set(chapter_files)
+        self.update_chapter_list()
+    
+    @staticmethod
+    def list_chapter_files(dir_path):
+        return [f for f in os.listdir(dir_path) if f.endswith('.txt') and not f.endswith('_完整版.txt')]
+    
+    @staticmethod
+    def chapter_from_file(dir_path, chapter_file):
+        # 文件名格式为 0001_标题.txt，与文件首行“第1章 标题”对应
+        number, _, title = os.path.splitext(chapter_file)[0].partition('_')
+        return {
+            'title': f"第{int(number)}章 {title}" if title else chapter_file,
+            'index': int(number),
+            'path': os.path.join(dir_path, chapter_file)
+        }
+    
+    def watch_book(self, book_path):
+        """监视打开的书籍，爬虫继续写入的章节不必重新打开就能看到"""
+        paths = self.book_watcher.files() + self.book_watcher.directories()
+        if paths:
+            self.book_watcher.removePaths(paths)
+        if not self.book_watcher.addPath(book_path):
+            print(f"无法监视 {book_path} 的变化")
+    
+    def unwatch_book(self):
+        self.tail_timer.stop()
+        paths = self.book_watcher.files() + self.book_watcher.directories()
+        if paths:
+            self.book_watcher.removePaths(paths)
+        self.known_chapter_files = set()
+        self.book_stat = None
+    
+    def on_book_changed(self, path):
+        # 下载很快时每秒会有很多次通知，合并成每半秒处理一次
+        if not self.tail_timer.isActive():
+            self.tail_timer.start()
+    
+    def refresh_book_tail(self):
+        """把书籍中新增的章节加入目录，不重新加载整本书"""
+        book_path = self.current_book
+        if not book_path or not os.path.exists(book_path):
+            return
+        try:
+            if os.path.isdir(book_path):
+                added = self.refresh_chapter_folder(book_path)
+            else:
+                added = self.refresh_merged_file(book_path)
+        except Exception as e:
+            print(f"更新章节目录失败: {e}")
+            return
+        finally:
+            # 文件被替换后监视会失效，重新加入
+            if os.path.exists(book_path) and book_path not in self.book_watcher.files() + self.book_watcher.directories():
+                self.book_watcher.addPath(book_path)
+        if added:
+            self.update_status_bar()
+            self.tail_index_timer.start()
+    
+    def refresh_chapter_folder(self, dir_path):
+        """章节文件夹：只比较文件名，返回新增的章节数"""
+        new_files = []
+        for chapter_file in self.list_chapter_files(dir_path):
+            if chapter_file in self.known_chapter_files:
+                continue
+            try:
+                int(chapter_file.split('_')[0])
+            except ValueError:
+                continue
+            new_files.append(chapter_file)
+        if not new_files:
+            return 0
+        self.known_chapter_files.update(new_files)
+        new_chapters = sorted((self.chapter_from_file(dir_path, f) for f in new_files), key=lambda c: c['index'])
+        
+        if not self.chapters or new_chapters[0]['index'] > self.chapters[-1]['index']:
+            # 按顺序下载时新章节都在末尾，直接追加
+            was_empty = not self.chapters
+            self.chapter_model.append_chapters(new_chapters)
+            if was_empty:
+                self.current_chapter_index = 0
+                self.display_chapter()
+            return len(new_chapters)
+        
+        # 并发下载时较早的章节可能后写入：插入到对应位置，章节序号变化，已排版的文档作废
+        current_path = self.chapters[self.current_chapter_index]['path'] \
+            if self.current_chapter_index < len(self.chapters) else None
+        position = self.current_position
+        self.chapters = sorted(self.chapters + new_chapters, key=lambda c: c['index'])
+        self.update_chapter_list()
+        if current_path:
+            self.current_chapter_index = next(i for i, c in enumerate(self.chapters) if c['path'] == current_path)
+        self.reset_render_cache()
+        self.page_starts = []
+        self.display_chapter()
+        self.restore_position(position)
+        return len(new_chapters)
+    
+    def refresh_merged_file(self, file_path):
+        """完整版文件：文件在末尾增长时从最后一章重新扫描，其他变化重新加载整本书"""
+        stat = os.stat(file_path)
+        old = self.book_stat
+        if old is not None and (stat.st_size, stat.st_mtime_ns) == (old.st_size, old.st_mtime_ns):
+            return 0
+        if old is None or stat.st_ino != old.st_ino or stat.st_size <= self.book_size or \
+                self.book_map_path != file_path:
+            # 文件被替换、截断、原地改写或读取的是转码副本
+            self.save_position()
+            self.load_book(file_path)
+            return 0
+        
+        self.book_stat = stat
+        self.open_book_map(file_path)
+        if self.book_map is None:
+            return 0
+        # 爬虫重新合并时会原地改写整个文件，前面章节的偏移可能变化：已建立目录的部分必须不变
+        digest = book_index.hash_range(self.book_map, hashlib.sha1(), 0, self.book_size)
+        if digest.hexdigest() != self.book_hash:
+            self.save_position()
+            self.load_book(file_path)
+            return 0
+        size = len(self.book_map)
+        self.book_hash = book_index.hash_range(self.book_map, digest, self.book_size, size).hexdigest()
+        self.book_size = size
+        start = self.chapters[-1]['offset'] if self.chapters else 0
+        scanned = book_index.scan_chapters(self.book_map, start, self.book_encoding)
+        if self.chapters and scanned:
+            last = self.chapters[-1]
+            grown = scanned.pop(0)
+            if grown['length'] != last['length']:
+                # 最后一章变长了，只丢弃这一章已缓存的旧内容
+                self.chapter_cache.discard(self.chapter_cache_key(last))
+                last['length'] = grown['length']
+                if self.current_chapter_index >= len(self.chapters) - 1 - self.config['continuous_window']:
+                    position = self.current_position
+                    self.reset_render_cache()
+                    self.display_chapter()
+                    self.restore_position(position)
+                else:
+                    # 正在显示的是更早的章节，它的文档仍在使用，不能清空整个缓存
+                    self.render_cache.discard(len(self.chapters) - 1)
+        new_chapters = [{
+            'title': chapter['title'],
+            'file': file_path,
+            'offset': chapter['offset'],
+            'length': chapter['length']
+        } for chapter in scanned]
+        if new_chapters:
+            was_empty = not self.chapters
+            self.chapter_model.append_chapters(new_chapters)
+            if was_empty:
+                self.current_chapter_index = 0
+                self.display_chapter()
+        return len(new_chapters)
+    
+    def update_tail_index(self):
+        """新章节停止增加后补全全文索引，正在搜索时不打断"""
+        if self.search_worker is None or not self.search_worker.isRunning():
+            self.start_search_worker()
+    
+    def attach_download(self, novel_dir, chapters, prioritize):
+        """打开正在下载的小说：按目录列出全部章节，已下载的可以直接阅读，
+        其余章节在阅读到时请求下载线程优先下载
+        """
+        self.unwatch_book()
+        self.page_cache.open_book(novel_dir)
+        self.stop_search_worker()
+        self.detach_download()
+        self.chapter_cache.clear()
+        self.reset_render_cache()
+        self.close_book_map()
+        existing = set(os.listdir(novel_dir)) if os.path.isdir(novel_dir) else set()
         self.chapters = []
-        for chapter_file in chapter_files:
-            chapter_path = os.path.join(dir_path, chapter_file)
-            with open(chapter_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-            
-            lines = content.split('\n')
-            title = lines[0].strip() if lines else chapter_file
-            chapter_content = '\n'.join(lines[1:]).strip() if len(lines) > 1 else content
-            
+        self.download_rows = {}
+        for row, chapter in enumerate(chapters):
+            filename = book_index.chapter_filename(chapter['index'], chapter['title'])
             self.chapters.append({
-                'title': title,
-                'content': chapter_content
+                'title': f"第{chapter['index']}章 {chapter['title']}",
+                'index': chapter['index'],
+                'path': os.path.join(novel_dir, filename),
+                'available': filename in existing
             })
-        
+            self.download_rows[chapter['index']] = row
+        self.download_prioritize = prioritize
+        self.current_book = novel_dir
+        self.current_chapter_index = 0
         self.update_chapter_list()
+        self.display_chapter()
+        self.update_bookmark_list()
+        self.open_search_index(novel_dir)
+    
+    def open_search_index(self, book_path):
+        """打开书籍的全文索引并在后台补全"""
+        self.stop_search_worker()
+        self.search_results.clear()
+        self.search_status.setText("")
+        self.search_index = SearchIndex(book_path, os.path.join(self.config_dir, "index"))
+        self.start_search_worker()
+    
+    def detach_download(self):
+        """下载结束或打开其他书籍时不再请求优先下载"""
+        self.download_prioritize = None
+        self.download_rows = {}
+    
+    def on_chapter_downloaded(self, chapter_index):
+        """下载线程保存了一章：更新章节列表，正在等待这一章时立即显示"""
+        row = self.download_rows.get(chapter_index)
+        if row is None or self.chapters[row].get('available', True):
+            return
+        self.chapters[row]['available'] = True
+        self.chapter_model.chapter_changed(row)
+        in_window = self.config['reading_mode'] == 'continuous' and \
+            self.window_first <= row < self.window_first + len(self.window_lengths)
+        if row == self.current_chapter_index or in_window:
+            position = self.current_position
+            self.display_chapter()
+            self.restore_position(position)
+    
+    def request_chapters(self, index):
+        """请求优先下载当前章节和之后几章中还没有下载的"""
+        if not self.download_prioritize:
+            return
+        window = self.chapters[index:index + 1 + self.config['download_prefetch']]
+        wanted = [chapter['index'] for chapter in window if not chapter.get('available', True)]
+        if wanted:
+            try:
+                self.download_prioritize(wanted)
+            except Exception as e:
+                print(f"请求优先下载失败: {e}")
     
     def update_chapter_list(self):
-        self.chapter_list.clear()
-        for i, chapter in enumerate(self.chapters):
-            item = QListWidgetItem(f"{i+1}. {chapter['title']}")
-            item.setData(Qt.UserRole, i)
-            self.chapter_list.addItem(item)
+        self.chapter_model.set_chapters(self.chapters)
+    
+    def apply_chapter_filter(self):
+        self.chapter_model.set_filter(self.chapter_filter.text())
+        self.select_current_chapter()
+    
+    def select_current_chapter(self):
+        """在章节列表中选中并显示当前章节，被筛选掉时不选中"""
+        row = self.chapter_model.row_of(self.current_chapter_index)
+        if row < 0:
+            self.chapter_list.clearSelection()
+            return
+        model_index = self.chapter_model.index(row)
+        self.chapter_list.setCurrentIndex(model_index)
+        self.chapter_list.scrollTo(model_index)
+    
+    def read_chapter_file(self, chapter):
+        """从磁盘读取章节正文：章节文件去掉首行标题，完整版中的章节从映射中按偏移切片"""
+        if 'path' in chapter:
+            lines = self.encodings.read_text(chapter['path']).split('\n', 1)
+            return lines[1].strip() if len(lines) > 1 else lines[0]
+        book_map = self.book_map
+        if book_map is not None and chapter['file'] == self.book_map_path:
+            # 切片不改变映射的读写位置，后台预读线程可以同时读取
+            data = book_map[chapter['offset']:chapter['offset'] + chapter['length']]
+            _, content = book_index.decode_chapter(data, chapter, self.book_encoding)
+            return content
+        with open(chapter['file'], 'rb') as f:
+            _, content = book_index.read_chapter(f, chapter, self.book_encoding)
+        return content
+    
+    @staticmethod
+    def chapter_cache_key(chapter):
+        return chapter['path'] if 'path' in chapter else (chapter['file'], chapter['offset'])
+    
+    def get_chapter_content(self, index):
+        """返回章节正文，按需从磁盘读取并缓存；尚未下载的章节返回 None"""
+        chapter = self.chapters[index]
+        if 'content' in chapter:
+            return chapter['content']
+        if not chapter.get('available', True):
+            return None
+        return self.chapter_cache.get(self.chapter_cache_key(chapter),
+                                      lambda: self.read_chapter_file(chapter))
+    
+    def prefetch_chapters(self, index):
+        """在后台预读前一章和后两章"""
+        for neighbor in (index + 1, index + 2, index - 1):
+            if 0 <= neighbor < len(self.chapters):
+                chapter = self.chapters[neighbor]
+                if 'content' not in chapter and chapter.get('available', True):
+                    self.chapter_cache.prefetch(self.chapter_cache_key(chapter),
+                                                lambda chapter=chapter: self.read_chapter_file(chapter))
     
     def display_chapter(self):
         if 0 <= self.current_chapter_index < len(self.chapters):
             chapter = self.chapters[self.current_chapter_index]
             self.chapter_title.setText(chapter['title'])
-            self.text_display.setPlainText(chapter['content'])
+            if self.config['reading_mode'] == 'continuous':
+                self.show_continuous(self.current_chapter_index)
+            else:
+                document = self.chapter_document(self.current_chapter_index)
+                if document is None:
+                    document = self.show_placeholder("本章正在下载，请稍候…")
+                self.text_display.setDocument(document)
+            if self.text_display.paged:
+                self.page_starts = self.paginate(self.current_chapter_index, document)
+                self.current_page = self.pending_page if self.pending_page >= 0 else len(self.page_starts) - 1
+                self.pending_page = 0
+                self.show_page()
+            self.request_chapters(self.current_chapter_index)
+            self.prefetch_chapters(self.current_chapter_index)
+            # 空闲时排版前后章节，翻页时直接换上
+            QTimer.singleShot(0, self.prerender_adjacent)
             
             # 更新章节列表选中状态
-            self.chapter_list.setCurrentRow(self.current_chapter_index)
+            self.select_current_chapter()
             
             # 更新状态栏
             self.update_status_bar()
             
             # 保存当前位置
-            self.config['last_chapter'] = self.current_chapter_index
-            self.save_config()
+            self.position_timer.start()
+    
+    def render_style(self):
+        return (self.config['font_family'], self.config['font_size'], self.config['line_spacing'])
+    
+    def block_format(self):
+        block_format = QTextBlockFormat()
+        block_format.setLineHeight(self.config['line_spacing'] * 100, QTextBlockFormat.ProportionalHeight)
+        return block_format
+    
+    def build_document(self, text):
+        """按当前字体设置生成并排版章节文档"""
+        document = QTextDocument(self)
+        document.setUndoRedoEnabled(False)
+        document.setDefaultFont(QFont(self.config['font_family'], self.config['font_size']))
+        cursor = QTextCursor(document)
+        # 先设置段落格式再插入文字，新段落继承该格式，不需要再全选合并
+        cursor.setBlockFormat(self.block_format())
+        cursor.insertText(text)
+        document.setTextWidth(self.text_display.viewport().width())
+        document.documentLayout().documentSize()
+        document.render_style = self.render_style()
+        return document
+    
+    def restyle_document(self, document):
+        """按当前字体设置重新排版一个已有的文档"""
+        document.setDefaultFont(QFont(self.config['font_family'], self.config['font_size']))
+        cursor = QTextCursor(document)
+        cursor.select(QTextCursor.Document)
+        cursor.mergeBlockFormat(self.block_format())
+        document.render_style = self.render_style()
+    
+    def chapter_document(self, index):
+        """取出章节的已排版文档，没有缓存时生成；章节尚未下载时返回 None"""
+        document = self.render_cache.get(index)
+        if document is None:
+            content = self.get_chapter_content(index)
+            if content is None:
+                return None
+            document = self.build_document(content)
+            keep = (self.current_chapter_index - 1, self.current_chapter_index, self.current_chapter_index + 1)
+            self.render_cache.put(index, document, keep)
+        elif document.render_style != self.render_style():
+            self.restyle_document(document)
+        return document
+    
+    def show_placeholder(self, text):
+        """提示文字使用单独的文档，避免覆盖缓存中的章节文档"""
+        if self.placeholder_document is None:
+            self.placeholder_document = QTextDocument(self)
+        self.placeholder_document.setDefaultFont(QFont(self.config['font_family'], self.config['font_size']))
+        self.placeholder_document.setPlainText(text)
+        return self.placeholder_document
+    
+    def prerender_adjacent(self):
+        """预先排版下一章和上一章（分页模式下同时分页），每次空闲只处理一章，保持界面响应"""
+        if self.config['reading_mode'] == 'continuous':
+            return
+        for index in (self.current_chapter_index + 1, self.current_chapter_index - 1):
+            if not 0 <= index < len(self.chapters) or not self.chapters[index].get('available', True):
+                continue
+            document = self.render_cache.get(index)
+            if document is not None and document.render_style == self.render_style():
+                if not self.text_display.paged or \
+                        self.page_cache.get(self.layout_key(), self.page_chapter_key(index, document)):
+                    continue
+            document = self.chapter_document(index)
+            if self.text_display.paged:
+                self.paginate(index, document)
+            QTimer.singleShot(0, self.prerender_adjacent)
+            return
+    
+    def set_reading_mode(self, mode):
+        """切换滚动、分页和连续滚动模式，保持当前阅读位置"""
+        position = self.current_position
+        self.config['reading_mode'] = mode
+        self.save_config()
+        for action, action_mode in ((self.paged_action, 'page'), (self.continuous_action, 'continuous')):
+            action.blockSignals(True)
+            action.setChecked(mode == action_mode)
+            action.blockSignals(False)
+        self.apply_reading_mode()
+        if self.chapters:
+            self.display_chapter()
+            self.restore_position(position)
+    
+    def apply_reading_mode(self):
+        """分页模式隐藏滚动条，翻页时直接跳到预先计算好的页首"""
+        paged = self.config['reading_mode'] == 'page'
+        self.text_display.paged = paged
+        self.text_display.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOff if paged else Qt.ScrollBarAsNeeded)
+        if not paged:
+            self.text_display.set_page_mask(0)
+            self.page_starts = []
+    
+    def layout_key(self):
+        viewport = self.text_display.viewport()
+        family, size, spacing = self.render_style()
+        return f"{family}|{size}|{spacing}|{viewport.width()}x{self.text_display.page_height()}"
+    
+    @staticmethod
+    def page_chapter_key(index, document):
+        # 带上字符数，章节内容变化后不会用到旧的分页结果
+        return f"{index}:{document.characterCount()}"
+    
+    def paginate(self, index, document):
+        """返回章节各页起始的纵坐标，只在没有缓存时遍历一次文档的行"""
+        layout_key = self.layout_key()
+        chapter_key = self.page_chapter_key(index, document)
+        if document is not self.placeholder_document:
+            starts = self.page_cache.get(layout_key, chapter_key)
+            if starts:
+                return starts
+        
+        width = self.text_display.viewport().width()
+        if document.textWidth() != width:
+            document.setTextWidth(width)
+        page_height = self.text_display.page_height()
+        layout = document.documentLayout()
+        starts = [0]
+        page_top = 0
+        block = document.begin()
+        while block.isValid():
+            block_top = layout.blockBoundingRect(block).top()
+            block_layout = block.layout()
+            for i in range(block_layout.lineCount()):
+                line = block_layout.lineAt(i)
+                top = block_top + line.y()
+                # 放不下的行移到下一页，保证每行完整地出现在某一页上
+                if top + line.height() - page_top > page_height and top > page_top:
+                    page_top = int(top)
+                    starts.append(page_top)
+            block = block.next()
+        
+        if document is not self.placeholder_document:
+            self.page_cache.put(layout_key, chapter_key, starts)
+        return starts
+    
+    def show_page(self):
+        """滚动到当前页的页首，并遮住下一页的内容"""
+        if not self.page_starts:
+            return
+        self.current_page = max(0, min(self.current_page, len(self.page_starts) - 1))
+        top = self.page_starts[self.current_page]
+        if self.current_page + 1 < len(self.page_starts):
+            bottom = self.page_starts[self.current_page + 1]
+        else:
+            bottom = int(self.text_display.document().size().height())
+        self.text_display.set_page_mask(max(0, self.text_display.page_height() - (bottom - top)))
+        self.text_display.verticalScrollBar().setValue(top)
+        self.update_status_bar()
+    
+    def turn_page(self, step):
+        """翻页，翻过章节首尾时进入相邻章节"""
+        if not self.page_starts:
+            return
+        page = self.current_page + step
+        if 0 <= page < len(self.page_starts):
+            self.current_page = page
+            self.show_page()
+        elif page < 0 and self.current_chapter_index > 0:
+            self.pending_page = -1
+            self.prev_chapter()
+        elif page >= len(self.page_starts) and self.current_chapter_index < len(self.chapters) - 1:
+            self.pending_page = 0
+            self.next_chapter()
+    
+    def restore_position(self, position):
+        """恢复滚动位置，分页模式下跳到包含该位置的页，连续滚动模式下位置相对于章节开头"""
+        if self.text_display.paged and self.page_starts:
+            self.current_page = max(0, bisect.bisect_right(self.page_starts, position) - 1)
+            self.show_page()
+        elif self.config['reading_mode'] == 'continuous' and self.window_lengths:
+            top = self.window_chapter_top(self.current_chapter_index)
+            self.text_display.verticalScrollBar().setValue(top + position)
+        else:
+            self.text_display.verticalScrollBar().setValue(position)
+    
+    def continuous_text(self, index):
+        """连续滚动模式中一章的文字: (标题, 正文)"""
+        content = self.get_chapter_content(index)
+        if content is None:
+            content = "本章正在下载，请稍候…"
+        return self.chapters[index]['title'], content
+    
+    def insert_window_chapter(self, cursor, index):
+        """在光标处插入一章，返回 (插入的字符数, 标题部分的字符数)"""
+        title, content = self.continuous_text(index)
+        title_format = QTextCharFormat()
+        title_format.setFontWeight(QFont.Bold)
+        start = cursor.position()
+        cursor.insertText(title, title_format)
+        cursor.insertText("\n\n", QTextCharFormat())
+        title_length = cursor.position() - start
+        cursor.insertText(content + "\n\n", QTextCharFormat())
+        return cursor.position() - start, title_length
+    
+    def show_continuous(self, index):
+        """以 index 为中心重新建立章节窗口"""
+        window = self.config['continuous_window']
+        self.adjusting_window = True
+        try:
+            if self.continuous_document is None:
+                self.continuous_document = QTextDocument(self)
+                self.continuous_document.setUndoRedoEnabled(False)
+            document = self.continuous_document
+            document.clear()
+            document.setDefaultFont(QFont(self.config['font_family'], self.config['font_size']))
+            cursor = QTextCursor(document)
+            cursor.setBlockFormat(self.block_format())
+            
+            self.window_first = max(0, index - window)
+            last = min(len(self.chapters) - 1, index + window)
+            self.window_lengths = []
+            self.window_title_lengths = []
+            for chapter_index in range(self.window_first, last + 1):
+                length, title_length = self.insert_window_chapter(cursor, chapter_index)
+                self.window_lengths.append(length)
+                self.window_title_lengths.append(title_length)
+            document.render_style = self.render_style()
+            
+            self.text_display.setDocument(document)
+            # 先完成排版，滚动条范围更新后再定位
+            document.documentLayout().documentSize()
+            self.text_display.verticalScrollBar().setValue(self.window_chapter_top(index))
+            self.current_position = 0
+        finally:
+            self.adjusting_window = False
+    
+    def window_chapter_start(self, index):
+        """章节在连续滚动文档中的起始字符位置"""
+        return sum(self.window_lengths[:index - self.window_first])
+    
+    def window_chapter_top(self, index):
+        """章节开头在连续滚动文档中的纵坐标"""
+        if not self.window_first <= index < self.window_first + len(self.window_lengths):
+            return 0
+        document = self.text_display.document()
+        block = document.findBlock(self.window_chapter_start(index))
+        return int(document.documentLayout().blockBoundingRect(block).top())
+    
+    def window_content_offset(self, index):
+        """章节正文在当前文档中的起始字符位置，非连续滚动模式下为 0"""
+        if self.config['reading_mode'] != 'continuous' or not self.window_lengths:
+            return 0
+        return self.window_chapter_start(index) + self.window_title_lengths[index - self.window_first]
+    
+    def update_continuous_window(self):
+        """滚动接近文档首尾时加入相邻章节，并从另一端移除超出窗口的章节，保持画面位置不动"""
+        scrollbar = self.text_display.verticalScrollBar()
+        document = self.text_display.document()
+        layout = document.documentLayout()
+        margin = self.text_display.viewport().height() * 2
+        window = self.config['continuous_window']
+        self.adjusting_window = True
+        try:
+            last = self.window_first + len(self.window_lengths) - 1
+            if scrollbar.value() > scrollbar.maximum() - margin and last < len(self.chapters) - 1:
+                cursor = QTextCursor(document)
+                cursor.movePosition(QTextCursor.End)
+                length, title_length = self.insert_window_chapter(cursor, last + 1)
+                self.window_lengths.append(length)
+                self.window_title_lengths.append(title_length)
+                if len(self.window_lengths) > window * 2 + 1:
+                    # 移除最前面的章节，画面随之上移的高度从滚动位置中减去
+                    removed_height = self.window_chapter_top(self.window_first + 1)
+                    cursor.setPosition(0)
+                    cursor.setPosition(self.window_lengths[0], QTextCursor.KeepAnchor)
+                    cursor.removeSelectedText()
+                    self.window_first += 1
+                    self.window_lengths.pop(0)
+                    self.window_title_lengths.pop(0)
+                    layout.documentSize()
+                    scrollbar.setValue(scrollbar.value() - removed_height + self.window_chapter_top(self.window_first))
+            elif scrollbar.value() < margin and self.window_first > 0:
+                cursor = QTextCursor(document)
+                cursor.setPosition(0)
+                length, title_length = self.insert_window_chapter(cursor, self.window_first - 1)
+                self.window_first -= 1
+                self.window_lengths.insert(0, length)
+                self.window_title_lengths.insert(0, title_length)
+                # 前面插入的内容把画面往下推，滚动位置加上插入的高度
+                inserted_height = int(layout.blockBoundingRect(document.findBlock(length)).top())
+                layout.documentSize()
+                scrollbar.setValue(scrollbar.value() + inserted_height)
+                if len(self.window_lengths) > window * 2 + 1:
+                    start = self.window_chapter_start(self.window_first + len(self.window_lengths) - 1)
+                    cursor.setPosition(start)
+                    cursor.movePosition(QTextCursor.End, QTextCursor.KeepAnchor)
+                    cursor.removeSelectedText()
+                    self.window_lengths.pop()
+                    self.window_title_lengths.pop()
+        finally:
+            self.adjusting_window = False
+    
+    def track_continuous_chapter(self):
+        """按视口顶部的文字确定当前章节，更新标题、章节列表和状态栏"""
+        position = self.text_display.cursorForPosition(QPoint(0, 0)).position()
+        index = self.window_first
+        offset = 0
+        for length in self.window_lengths:
+            if position < offset + length:
+                break
+            offset += length
+            index += 1
+        index = min(index, self.window_first + len(self.window_lengths) - 1)
+        if index != self.current_chapter_index:
+            self.current_chapter_index = index
+            self.chapter_title.setText(self.chapters[index]['title'])
+            self.select_current_chapter()
+            self.update_status_bar()
+            self.request_chapters(index)
+            self.prefetch_chapters(index)
+    
+    def on_reading_area_resized(self):
+        if self.text_display.paged:
+            self.repaginate_timer.start()
+    
+    def repaginate(self):
+        if self.text_display.paged and self.chapters:
+            position = self.page_starts[self.current_page] if self.page_starts else 0
+            self.text_display.set_page_mask(0)
+            self.page_starts = self.paginate(self.current_chapter_index, self.text_display.document())
+            self.restore_position(position)
+    
+    def reset_render_cache(self):
+        """换书时丢弃所有已排版文档"""
+        self.text_display.setDocument(self.show_placeholder(""))
+        self.render_cache.clear()
+        self.window_lengths = []
+        self.window_title_lengths = []
     
     def update_status_bar(self):
         if self.chapters:
             progress = (self.current_chapter_index + 1) / len(self.chapters) * 100
             self.progress_label.setText(f"进度: {progress:.1f}%")
             
-            self.chapter_info_label.setText(
-                f"第 {self.current_chapter_index + 1} 章 / 共 {len(self.chapters)} 章"
-            )
+            chapter_info = f"第 {self.current_chapter_index + 1} 章 / 共 {len(self.chapters)} 章"
+            if self.text_display.paged and self.page_starts:
+                chapter_info += f"  第 {self.current_page + 1} / {len(self.page_starts)} 页"
+            self.chapter_info_label.setText(chapter_info)
             
             # 显示阅读时间
             if self.current_book:
@@ -513,8 +1559,8 @@ class NovelReader(QMainWindow):
                 minutes = stats['total_time'] % 60
                 self.reading_time_label.setText(f"阅读时间: {hours}h {minutes}m")
     
-    def on_chapter_selected(self, item):
-        chapter_index = item.data(Qt.UserRole)
+    def on_chapter_selected(self, model_index):
+        chapter_index = model_index.data(Qt.UserRole)
         if chapter_index is not None:
             self.current_chapter_index = chapter_index
             self.display_chapter()
@@ -530,16 +1576,35 @@ class NovelReader(QMainWindow):
             self.display_chapter()
     
     def scroll_up(self):
+        if self.text_display.paged:
+            self.turn_page(-1)
+            return
         scrollbar = self.text_display.verticalScrollBar()
         scrollbar.setValue(scrollbar.value() - scrollbar.pageStep())
     
     def scroll_down(self):
+        if self.text_display.paged:
+            self.turn_page(1)
+            return
         scrollbar = self.text_display.verticalScrollBar()
         scrollbar.setValue(scrollbar.value() + scrollbar.pageStep())
     
     def on_scroll_changed(self, value):
-        self.current_position = value
-        self.config['last_position'] = value
+        if self.adjusting_window:
+            return
+        if self.config['reading_mode'] == 'continuous' and self.window_lengths:
+            self.update_continuous_window()
+            self.track_continuous_chapter()
+            value = self.text_display.verticalScrollBar().value()
+            self.current_position = value - self.window_chapter_top(self.current_chapter_index)
+        else:
+            self.current_position = value
+        self.position_timer.start()
+    
+    def save_position(self):
+        """把当前书籍的阅读位置写入书库，翻页和滚动停下后才写"""
+        if self.current_book and self.chapters:
+            self.library.save_position(self.current_book, self.current_chapter_index, self.current_position)
     
     def change_font_size(self, size):
         self.config['font_size'] = size
@@ -553,15 +1618,15 @@ class NovelReader(QMainWindow):
         self.save_config()
     
     def apply_font_settings(self):
+        """只重新排版正在显示的文档，缓存中的其他文档在使用时再按新设置排版"""
         font = QFont(self.config['font_family'], self.config['font_size'])
         self.text_display.setFont(font)
         
-        # 设置行间距
-        cursor = self.text_display.textCursor()
-        block_format = QTextBlockFormat()
-        block_format.setLineHeight(self.config['line_spacing'] * 100, QTextBlockFormat.ProportionalHeight)
-        cursor.select(QTextCursor.Document)
-        cursor.mergeBlockFormat(block_format)
+        document = self.text_display.document()
+        if document is self.placeholder_document:
+            document.setDefaultFont(font)
+        elif getattr(document, 'render_style', None) not in (None, self.render_style()):
+            self.restyle_document(document)
     
     def apply_theme(self):
         themes = {
@@ -604,8 +1669,6 @@ class NovelReader(QMainWindow):
                 background-color: {theme['sidebar_bg']};
             }}
         """)
-        
-        self.apply_font_settings()
     
     def font_settings(self):
         font, ok = QFontDialog.getFont(QFont(self.config['font_family'], self.config['font_size']), self)
@@ -661,13 +1724,66 @@ class NovelReader(QMainWindow):
         if ok and text:
             self.search_text(text)
     
+    def chapter_text(self, chapter):
+        """在后台线程中读取章节正文，不经过章节缓存"""
+        if 'content' in chapter:
+            return chapter['content']
+        return self.read_chapter_file(chapter)
+    
+    def start_search_worker(self, query=None):
+        """启动后台索引/搜索线程，先停止正在运行的线程"""
+        self.stop_search_worker()
+        if self.search_index is None:
+            return
+        self.search_worker = SearchWorker(self.search_index, self.chapters, self.chapter_text, query, self)
+        self.search_worker.hit_found.connect(self.on_search_hit)
+        self.search_worker.search_finished.connect(self.on_search_finished)
+        self.search_worker.start()
+    
+    def stop_search_worker(self):
+        if self.search_worker is not None:
+            self.search_worker.requestInterruption()
+            self.search_worker.wait()
+            self.search_worker = None
+    
     def search_text(self, text):
-        cursor = self.text_display.textCursor()
-        cursor.movePosition(QTextCursor.Start)
-        
-        found = self.text_display.find(text)
-        if not found:
-            QMessageBox.information(self, "搜索结果", "未找到匹配的内容")
+        """在整本书中搜索，结果逐条显示在搜索结果面板中"""
+        if not self.chapters:
+            QMessageBox.warning(self, "警告", "请先打开一本小说")
+            return
+        self.search_query = text
+        self.search_results.clear()
+        self.search_status.setText(f"正在搜索“{text}”…")
+        self.search_dock.show()
+        self.start_search_worker(text)
+    
+    def on_search_hit(self, chapter_index, position, snippet):
+        title = self.chapters[chapter_index]['title'] if chapter_index < len(self.chapters) else ""
+        item = QListWidgetItem(f"{title}  [{position}]  …{snippet}…")
+        item.setData(Qt.UserRole, (chapter_index, position, len(self.search_query)))
+        self.search_results.addItem(item)
+    
+    def on_search_finished(self, hits, cancelled):
+        if cancelled:
+            return
+        if hits:
+            self.search_status.setText(f"“{self.search_query}”共 {hits} 处")
+        else:
+            self.search_status.setText(f"未找到“{self.search_query}”")
+    
+    def on_search_result_selected(self, item):
+        """跳转到命中位置并选中匹配的文字"""
+        chapter_index, position, length = item.data(Qt.UserRole)
+        if chapter_index >= len(self.chapters):
+            return
+        self.current_chapter_index = chapter_index
+        self.display_chapter()
+        position += self.window_content_offset(chapter_index)
+        cursor = QTextCursor(self.text_display.document())
+        cursor.setPosition(position)
+        cursor.setPosition(position + length, QTextCursor.KeepAnchor)
+        self.text_display.setTextCursor(cursor)
+        self.text_display.ensureCursorVisible()
     
     def add_bookmark(self):
         if not self.current_book:
@@ -711,7 +1827,7 @@ class NovelReader(QMainWindow):
         if bookmark:
             self.current_chapter_index = bookmark['chapter_index']
             self.display_chapter()
-            self.text_display.verticalScrollBar().setValue(bookmark['position'])
+            self.restore_position(bookmark['position'])
     
     def show_stats(self):
         if not self.current_book:
@@ -748,14 +1864,19 @@ class NovelReader(QMainWindow):
             self.update_status_bar()
     
     def closeEvent(self, event):
+        self.unwatch_book()
+        self.tail_index_timer.stop()
+        self.stop_search_worker()
+        self.close_book_map()
+        
         # 保存窗口几何
         self.config['window_geometry'] = self.saveGeometry().toBase64().data().decode()
         self.save_config()
+        self.state_writer.flush()
         
-        # 更新最后阅读时间
-        if self.current_book:
-            session_time = (datetime.now() - self.reading_stats.session_start).total_seconds() / 60
-            self.reading_stats.update_reading_time(self.current_book, int(session_time))
+        self.position_timer.stop()
+        self.save_position()
+        self.page_cache.flush()
         
         event.accept()
 
@@ -768,13 +1889,11 @@ def main():
     app.setStyle('Fusion')
     
     reader = NovelReader()
-    
-    # 如果有上次打开的书籍，自动加载
-    if reader.config['last_book'] and os.path.exists(reader.config['last_book']):
-        reader.load_book(reader.config['last_book'])
-    
     reader.show()
     
+    # 窗口显示出来之后再打开上次阅读的书籍
+    QTimer.singleShot(0, reader.restore_last_book)
+    
     sys.exit(app.exec_())
 
 if __name__ == "__main__":
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+整本书全文搜索索引
+按相邻两个字（二元组）建立倒排索引，中文不需要分词。索引只记录二元组出现在哪些章节，
+搜索时先求候选章节的交集，再在候选章节中精确查找并生成摘要。
+索引以差值变长整数压缩保存在书籍旁，新增或变化的章节增量更新
+"""
+
+import os
+import json
+import zlib
+import array
+import bisect
+import hashlib
+import threading
+
+INDEX_VERSION = 1
+
+def index_path(book_path):
+    """完整版文件: xxx_完整版.search.idx；章节文件夹: 目录下的 .search.idx"""
+    if os.path.isdir(book_path):
+        return os.path.join(book_path, ".search.idx")
+    return os.path.splitext(book_path)[0] + ".search.idx"
+
+def fallback_index_path(book_path, index_dir):
+    key = hashlib.sha1(os.path.abspath(book_path).encode('utf-8')).hexdigest()
+    return os.path.join(index_dir, key + ".search.idx")
+
+def bigrams(text):
+    """文字和数字连续片段中的相邻二字组合，忽略空白和标点，英文不区分大小写"""
+    grams = set()
+    previous = None
+    for char in text.lower():
+        if char.isalnum():
+            if previous is not None:
+                grams.add(previous + char)
+            previous = char
+        else:
+            previous = None
+    return grams
+
+def chapter_signature(chapter):
+    """章节的版本标识，变化时重新索引该章；尚未下载的章节返回 None"""
+    if not chapter.get('available', True):
+        return None
+    if 'path' in chapter:
+        try:
+            stat = os.stat(chapter['path'])
+        except OSError:
+            return None
+        return f"{os.path.basename(chapter['path'])}:{stat.st_size}:{stat.st_mtime_ns}"
+    if 'offset' in chapter:
+        return f"{chapter['offset']}:{chapter['length']}:{chapter['title']}"
+    return hashlib.sha1(chapter['content'].encode('utf-8')).hexdigest()
+
+def _encode_postings(ids):
+    """升序章节号按差值写成变长整数"""
+    data = bytearray()
+    last = 0
+    for chapter_id in ids:
+        delta = chapter_id - last
+        last = chapter_id
+        while delta >= 0x80:
+            data.append((delta & 0x7f) | 0x80)
+            delta >>= 7
+        data.append(delta)
+    return bytes(data)
+
+def _decode_postings(data):
+    ids = array.array('I')
+    value = 0
+    shift = 0
+    last = 0
+    for byte in data:
+        value |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        last += value
+        ids.append(last)
+        value = 0
+        shift = 0
+    return ids
+
+class SearchIndex:
+    """一本书的二元组倒排索引
+
+    文件格式: 魔数、4 字节头部长度、zlib 压缩的 JSON 头部（章节版本标识、二元组及其
+    倒排列表字节数），之后是依次拼接的倒排列表。加载时只解析头部，倒排列表在查询用到时才解码。
+    章节被修改时不从旧的倒排列表中删除记录，多出的候选章节在精确查找时被排除
+    """
+    MAGIC = b'NSIX'
+
+    def __init__(self, book_path, index_dir=None):
+        self.book_path = book_path
+        self.path = index_path(book_path)
+        self.fallback_path = fallback_index_path(book_path, index_dir) if index_dir else None
+        self.signatures = []
+        # 二元组 -> 倒排列表在 blob 中的 (起点, 终点)，或被修改过的章节数组
+        self.postings = {}
+        self.blob = b''
+        self.dirty = False
+        self.lock = threading.Lock()
+        self.load_index()
+
+    def load_index(self):
+        for path in (self.path, self.fallback_path):
+            if not path or not os.path.exists(path):
+                continue
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+                if data[:4] != self.MAGIC:
+                    continue
+                header_size = int.from_bytes(data[4:8], 'little')
+                header = json.loads(zlib.decompress(data[8:8 + header_size]).decode('utf-8'))
+                if header.get('version') != INDEX_VERSION:
+                    continue
+                self.blob = data[8 + header_size:]
+                self.signatures = header['signatures']
+                self.postings = {}
+                position = 0
+                for gram, size in zip(header['grams'], header['sizes']):
+                    self.postings[gram] = (position, position + size)
+                    position += size
+                return
+            except Exception as e:
+                print(f"加载搜索索引失败: {e}")
+
+    def save_index(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            grams = list(self.postings)
+            parts = []
+            postings = {}
+            position = 0
+            for gram in grams:
+                ids = self.postings[gram]
+                part = self.blob[ids[0]:ids[1]] if isinstance(ids, tuple) else _encode_postings(ids)
+                parts.append(part)
+                postings[gram] = (position, position + len(part))
+                position += len(part)
+            self.blob = b''.join(parts)
+            self.postings = postings
+            header = zlib.compress(json.dumps({
+                'version': INDEX_VERSION,
+                'signatures': self.signatures,
+                'grams': grams,
+                'sizes': [len(part) for part in parts]
+            }, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+            blob = self.blob
+            self.dirty = False
+
+        for path in (self.path, self.fallback_path):
+            if not path:
+                continue
+            try:
+                os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+                with open(path + ".tmp", 'wb') as f:
+                    f.write(self.MAGIC)
+                    f.write(len(header).to_bytes(4, 'little'))
+                    f.write(header)
+                    f.write(blob)
+                os.replace(path + ".tmp", path)
+                return
+            except OSError as e:
+                print(f"保存搜索索引失败: {e}")
+
+    def _ids(self, gram, create=False):
+        """取出章节数组，调用方须持有锁；create 为 True 时转为可修改的数组"""
+        ids = self.postings.get(gram)
+        if ids is None:
+            if not create:
+                return None
+            ids = self.postings[gram] = array.array('I')
+        elif isinstance(ids, tuple):
+            ids = _decode_postings(self.blob[ids[0]:ids[1]])
+            if create:
+                self.postings[gram] = ids
+        return ids
+
+    def update(self, chapters, read_text, should_stop=None):
+        """索引新增和变化的章节，返回重新索引的章节数
+
+        read_text(chapter) 返回章节正文；超过一半章节变化时（例如完整版文件重新合并）整体重建
+        """
+        signatures = [chapter_signature(chapter) for chapter in chapters]
+        with self.lock:
+            old = self.signatures
+            changed = [i for i, signature in enumerate(signatures)
+                       if signature is not None and (i >= len(old) or old[i] != signature)]
+            stale = sum(1 for i in changed if i < len(old) and old[i] is not None)
+            if stale > len(signatures) // 2:
+                self.postings = {}
+                self.blob = b''
+                old = []
+            self.signatures = [signature if i < len(signatures) and signatures[i] == signature else None
+                               for i, signature in enumerate(old[:len(signatures)])]
+            if changed or len(old) != len(self.signatures):
+                self.dirty = True
+
+        indexed = 0
+        for i in changed:
+            if should_stop and should_stop():
+                break
+            try:
+                grams = bigrams(read_text(chapters[i]))
+            except Exception as e:
+                print(f"索引章节 {i + 1} 失败: {e}")
+                continue
+            with self.lock:
+                for gram in grams:
+                    ids = self._ids(gram, create=True)
+                    if not ids or ids[-1] < i:
+                        ids.append(i)
+                    else:
+                        # 中间的章节被重新索引，保持升序且不重复
+                        position = bisect.bisect_left(ids, i)
+                        if position == len(ids) or ids[position] != i:
+                            ids.insert(position, i)
+                if len(self.signatures) <= i:
+                    self.signatures.extend([None] * (i + 1 - len(self.signatures)))
+                self.signatures[i] = signatures[i]
+                self.dirty = True
+            indexed += 1
+        return indexed
+
+    def candidates(self, query):
+        """包含查询中全部二元组的章节；查询不足两个字时返回 None，表示需要逐章查找"""
+        grams = bigrams(query)
+        if not grams:
+            return None
+        with self.lock:
+            lists = []
+            for gram in grams:
+                ids = self._ids(gram)
+                if not ids:
+                    return []
+                lists.append(ids)
+        lists.sort(key=len)
+        result = set(lists[0])
+        for ids in lists[1:]:
+            result.intersection_update(ids)
+            if not result:
+                break
+        return sorted(result)
+
+    def search(self, query, chapters, read_text, context=20, max_hits=1000, should_stop=None):
+        """逐个产出命中 (章节序号, 正文中的位置, 摘要)"""
+        needle = query.strip().lower()
+        if not needle:
+            return
+        candidates = self.candidates(needle)
+        if candidates is None:
+            candidates = range(len(chapters))
+
+        hits = 0
+        for i in candidates:
+            if i >= len(chapters) or (should_stop and should_stop()):
+                return
+            if not chapters[i].get('available', True):
+                continue
+            try:
+                text = read_text(chapters[i])
+            except Exception as e:
+                print(f"读取章节 {i + 1} 失败: {e}")
+                continue
+            lowered = text.lower()
+            position = lowered.find(needle)
+            while position >= 0:
+                start = max(0, position - context)
+                snippet = text[start:position + len(needle) + context].replace('\n', ' ')
+                yield i, position, snippet
+                hits += 1
+                if hits >= max_hits:
+                    return
+                position = lowered.find(needle, position + len(needle))
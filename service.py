@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+下载服务模式
+在本机 HTTP 接口后面运行一个常驻的 NovelSpider，供其他工具提交、查询、取消下载任务
+并以 Server-Sent Events 流式接收进度。连接池、学习到的模板行和限速状态在任务之间保持
+
+接口：
+    GET  /health                 服务状态
+    POST /jobs                   提交任务 {"novel_id": "12345", "output_dir": "novels", "retry_only": false}
+    GET  /jobs                   任务列表
+    GET  /jobs/<id>              任务详情
+    POST /jobs/<id>/cancel       取消任务（DELETE /jobs/<id> 等价）
+    GET  /jobs/<id>/events       进度事件流 (text/event-stream)
+"""
+
+import sys
+import json
+import time
+import uuid
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from spider import NovelSpider, RateGovernor
+
+def parse_host_limit(text):
+    """解析 --host-limit 参数 "域名=请求数每秒[:带宽KB每秒]"，返回 (域名, 字节每秒, 请求数每秒)"""
+    host, sep, limits = text.partition('=')
+    if not sep or not host.strip():
+        raise argparse.ArgumentTypeError(f"站点限速格式应为 域名=次每秒[:KB每秒]: {text}")
+    requests_per_sec, _, kb_per_sec = limits.partition(':')
+    try:
+        return host.strip(), float(kb_per_sec or 0) * 1024, float(requests_per_sec or 0)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"站点限速格式应为 域名=次每秒[:KB每秒]: {text}")
+
+class DownloadJob:
+    """单个下载任务及其进度事件"""
+    def __init__(self, novel_id, output_dir="novels", retry_only=False, max_events=1000):
+        self.id = uuid.uuid4().hex[:12]
+        self.novel_id = novel_id
+        self.output_dir = output_dir
+        self.retry_only = retry_only
+        self.status = 'queued'
+        self.created_time = time.time()
+        self.finished_time = None
+        self.progress = {'total': 0, 'completed': 0, 'failed': 0}
+        self.title = None
+        self.novel_dir = None
+        self.error = None
+        self.cancel_event = threading.Event()
+        # 事件序号从 0 递增，只保留最近 max_events 条
+        self.events = deque(maxlen=max_events)
+        self.event_count = 0
+        self.condition = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed', 'cancelled')
+
+    def add_event(self, event):
+        with self.condition:
+            event = dict(event, seq=self.event_count, time=time.time())
+            self.events.append(event)
+            self.event_count += 1
+            for key in ('total', 'completed', 'failed'):
+                if key in event:
+                    self.progress[key] = event[key]
+            if event['type'] == 'start':
+                self.title = event.get('title')
+                self.novel_dir = event.get('novel_dir')
+            elif event['type'] == 'error':
+                self.error = event.get('message')
+            self.condition.notify_all()
+
+    def set_status(self, status, error=None):
+        # 状态和状态事件在同一次加锁中更新，事件流不会在两者之间看到任务已结束而提前关闭
+        with self.condition:
+            self.status = status
+            self.error = error
+            if self.finished:
+                self.finished_time = time.time()
+            self.add_event({'type': 'status', 'status': status, 'error': error})
+
+    def events_after(self, seq, timeout):
+        """返回序号大于等于 seq 的事件，没有新事件时最多等待 timeout 秒"""
+        with self.condition:
+            if self.event_count <= seq and not self.finished:
+                self.condition.wait(timeout)
+            return [event for event in self.events if event['seq'] >= seq]
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'novel_id': self.novel_id,
+            'output_dir': self.output_dir,
+            'retry_only': self.retry_only,
+            'status': self.status,
+            'title': self.title,
+            'novel_dir': self.novel_dir,
+            'progress': dict(self.progress),
+            'error': self.error,
+            'created_time': self.created_time
+        }
+
+class DownloadService:
+    """任务调度：复用同一个 NovelSpider，按提交顺序执行任务
+
+    已结束的任务保留 job_ttl 秒，最多保留 max_finished 个，超出后先清理最早结束的任务
+    """
+    def __init__(self, spider=None, max_jobs=1, job_ttl=3600, max_finished=100):
+        self.spider = spider or NovelSpider(max_workers=3, governor=RateGovernor())
+        self.job_ttl = job_ttl
+        self.max_finished = max_finished
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_jobs)
+
+    def submit(self, novel_id, output_dir="novels", retry_only=False):
+        job = DownloadJob(novel_id, output_dir, retry_only)
+        with self.lock:
+            self._prune()
+            self.jobs[job.id] = job
+        job.add_event({'type': 'status', 'status': 'queued', 'error': None})
+        self.executor.submit(self._run, job)
+        return job
+
+    def _run(self, job):
+        if job.cancel_event.is_set():
+            job.set_status('cancelled')
+            return
+        job.set_status('running')
+        try:
+            if job.retry_only:
+                result = self.spider.retry_failed(job.novel_id, job.output_dir,
+                                                  progress_callback=job.add_event,
+                                                  cancel_event=job.cancel_event)
+            else:
+                result = self.spider.download_novel(job.novel_id, job.output_dir,
+                                                    progress_callback=job.add_event,
+                                                    cancel_event=job.cancel_event)
+        except Exception as e:
+            job.set_status('failed', str(e))
+            return
+
+        if job.cancel_event.is_set():
+            job.set_status('cancelled')
+        elif result:
+            job.novel_dir = result
+            job.set_status('done')
+        else:
+            job.set_status('failed', job.error or "下载失败")
+
+    def _prune(self):
+        """清理过期的已结束任务，调用方持有 self.lock"""
+        now = time.time()
+        finished = sorted((job for job in self.jobs.values() if job.finished and job.finished_time),
+                          key=lambda job: job.finished_time)
+        excess = len(finished) - self.max_finished
+        for i, job in enumerate(finished):
+            if i < excess or now - job.finished_time > self.job_ttl:
+                del self.jobs[job.id]
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list_jobs(self):
+        with self.lock:
+            self._prune()
+            return [job.to_dict() for job in self.jobs.values()]
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job and not job.finished:
+            job.cancel_event.set()
+            job.add_event({'type': 'cancel_requested'})
+        return job
+
+    def shutdown(self):
+        with self.lock:
+            for job in self.jobs.values():
+                job.cancel_event.set()
+        self.executor.shutdown(wait=True)
+
+class ServiceRequestHandler(BaseHTTPRequestHandler):
+    """本地 HTTP 接口"""
+    server_version = "NovelSpiderService/1.0"
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if not length:
+            return {}
+        return json.loads(self.rfile.read(length).decode('utf-8'))
+
+    def path_parts(self):
+        return [part for part in self.path.split('?', 1)[0].split('/') if part]
+
+    def do_GET(self):
+        parts = self.path_parts()
+        if parts == ['health']:
+            spider = self.service.spider
+            self.send_json({'status': 'ok', 'jobs': len(self.service.jobs),
+                            'metrics': dict(spider.metrics),
+                            'proxies': spider.proxy_pool.stats() if spider.proxy_pool else []})
+        elif parts == ['jobs']:
+            self.send_json({'jobs': self.service.list_jobs()})
+        elif len(parts) == 2 and parts[0] == 'jobs':
+            job = self.service.get(parts[1])
+            if job:
+                self.send_json(job.to_dict())
+            else:
+                self.send_json({'error': "任务不存在"}, 404)
+        elif len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'events':
+            job = self.service.get(parts[1])
+            if job:
+                self.stream_events(job)
+            else:
+                self.send_json({'error': "任务不存在"}, 404)
+        else:
+            self.send_json({'error': "未知接口"}, 404)
+
+    def do_POST(self):
+        parts = self.path_parts()
+        if parts == ['jobs']:
+            try:
+                data = self.read_json()
+            except ValueError:
+                self.send_json({'error': "请求体不是有效的 JSON"}, 400)
+                return
+            novel_id = str(data.get('novel_id', '')).strip()
+            if not novel_id.isdigit():
+                self.send_json({'error': "小说ID应该是数字"}, 400)
+                return
+            job = self.service.submit(novel_id, data.get('output_dir') or "novels",
+                                      bool(data.get('retry_only')))
+            self.send_json(job.to_dict(), 201)
+        elif len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'cancel':
+            self.cancel_job(parts[1])
+        else:
+            self.send_json({'error': "未知接口"}, 404)
+
+    def do_DELETE(self):
+        parts = self.path_parts()
+        if len(parts) == 2 and parts[0] == 'jobs':
+            self.cancel_job(parts[1])
+        else:
+            self.send_json({'error': "未知接口"}, 404)
+
+    def cancel_job(self, job_id):
+        job = self.service.cancel(job_id)
+        if job:
+            self.send_json(job.to_dict())
+        else:
+            self.send_json({'error': "任务不存在"}, 404)
+
+    def stream_events(self, job):
+        """以 Server-Sent Events 推送进度，任务结束后关闭连接"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream; charset=utf-8')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        try:
+            seq = max(int(self.headers.get('Last-Event-ID')) + 1, 0)
+        except (TypeError, ValueError):
+            # 没有或无法识别的 Last-Event-ID 从头推送
+            seq = 0
+        try:
+            while True:
+                events = job.events_after(seq, timeout=15)
+                if events:
+                    for event in events:
+                        self.wfile.write(
+                            f"id: {event['seq']}\nevent: {event['type']}\n"
+                            f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode('utf-8')
+                        )
+                    seq = events[-1]['seq'] + 1
+                elif not job.finished:
+                    # 心跳，防止连接被中间设备断开
+                    self.wfile.write(b": keep-alive\n\n")
+                self.wfile.flush()
+                if job.finished and seq >= job.event_count:
+                    break
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+class ServiceServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, service, verbose=False):
+        super().__init__(address, ServiceRequestHandler)
+        self.service = service
+        self.verbose = verbose
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="笔趣阁小说下载服务")
+    parser.add_argument('--host', default="127.0.0.1", help="监听地址，默认只监听本机")
+    parser.add_argument('--port', type=int, default=8765, help="监听端口")
+    parser.add_argument('--base-url', default="https://www.577ff.cfd", help="小说站点地址")
+    parser.add_argument('--workers', type=int, default=3, help="每个任务的下载线程数")
+    parser.add_argument('--max-jobs', type=int, default=1, help="同时执行的任务数")
+    parser.add_argument('--job-ttl', type=int, default=3600, help="已结束任务保留的秒数")
+    parser.add_argument('--host-limit', type=parse_host_limit, action='append', default=[],
+                        help="单个站点的限速，格式 域名=次每秒[:KB每秒]，可重复指定")
+    parser.add_argument('--store', action='store_true', help="开启章节存储，记录章节的历史版本")
+    parser.add_argument('--verbose', action='store_true', help="输出访问日志")
+    args = parser.parse_args()
+
+    governor = RateGovernor()
+    for host, bytes_per_sec, requests_per_sec in args.host_limit:
+        governor.set_host_limits(host, bytes_per_sec, requests_per_sec)
+    spider = NovelSpider(base_url=args.base_url, max_workers=args.workers,
+                         governor=governor, store=args.store)
+    service = DownloadService(spider, max_jobs=args.max_jobs, job_ttl=args.job_ttl)
+    server = ServiceServer((args.host, args.port), service, args.verbose)
+    print(f"下载服务已启动: http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n正在停止服务...")
+    finally:
+        server.server_close()
+        service.shutdown()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
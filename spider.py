@@ -10,16 +10,256 @@ import os
 import json
 import re
 import time
+import hashlib
+import asyncio
+from datetime import datetime
 import threading
+from collections import deque
 from bs4 import BeautifulSoup
 from urllib.parse import urljoin, urlparse
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
 import chardet
+from cleaner import ContentCleaner
+from tracing import tracer, traced
+from store import ChapterStore
+from proxies import ProxyPool, PROXY_FAILURE_STATUS
+import book_index
+
+class LatencyTracker:
+    """记录最近的请求耗时，用于计算分位数"""
+    def __init__(self, size=200, min_samples=20):
+        self.samples = deque(maxlen=size)
+        self.min_samples = min_samples
+        self.lock = threading.Lock()
+    
+    def add(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+    
+    def percentile(self, p):
+        """返回第 p 分位的耗时，样本不足时返回 None"""
+        with self.lock:
+            if len(self.samples) < self.min_samples:
+                return None
+            data = sorted(self.samples)
+        k = min(len(data) - 1, int(len(data) * p))
+        return data[k]
+
+class TokenBucket:
+    """令牌桶，rate 为每秒补充的令牌数，rate 为 0 表示不限速"""
+    def __init__(self, rate=0, capacity=None):
+        self.lock = threading.Lock()
+        self.rate = 0
+        self.capacity = 0
+        self.tokens = None
+        self.updated = time.monotonic()
+        self.set_rate(rate, capacity)
+    
+    def set_rate(self, rate, capacity=None):
+        """运行时调整速率，默认允许一秒的突发量"""
+        with self.lock:
+            self.rate = rate or 0
+            self.capacity = capacity or max(self.rate, 1)
+            self.tokens = self.capacity if self.tokens is None else min(self.tokens, self.capacity)
+            self.updated = time.monotonic()
+    
+    def reserve(self, amount):
+        """扣除令牌（允许透支），返回调用方需要等待的秒数"""
+        with self.lock:
+            if self.rate <= 0:
+                return 0
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            if self.tokens >= 0:
+                return 0
+            return -self.tokens / self.rate
+
+class RateGovernor:
+    """全局及按站点的带宽 / 请求频率限制，可被多个爬虫共享"""
+    def __init__(self, bytes_per_sec=0, requests_per_sec=0):
+        self.global_bytes = TokenBucket(bytes_per_sec)
+        self.global_requests = TokenBucket(requests_per_sec)
+        self.host_buckets = {}
+        self.lock = threading.Lock()
+    
+    def set_global_limits(self, bytes_per_sec=None, requests_per_sec=None):
+        if bytes_per_sec is not None:
+            self.global_bytes.set_rate(bytes_per_sec)
+        if requests_per_sec is not None:
+            self.global_requests.set_rate(requests_per_sec)
+    
+    def set_host_limits(self, host, bytes_per_sec=0, requests_per_sec=0):
+        """设置单个站点的限制，两项都为 0 时移除该站点的限制
+
+        host 为 "域名[:端口]"，也可以直接传入站点地址
+        """
+        if '//' in host:
+            host = urlparse(host).netloc
+        with self.lock:
+            if not bytes_per_sec and not requests_per_sec:
+                self.host_buckets.pop(host, None)
+            elif host in self.host_buckets:
+                self.host_buckets[host]['bytes'].set_rate(bytes_per_sec)
+                self.host_buckets[host]['requests'].set_rate(requests_per_sec)
+            else:
+                self.host_buckets[host] = {
+                    'bytes': TokenBucket(bytes_per_sec),
+                    'requests': TokenBucket(requests_per_sec)
+                }
+    
+    def _wait(self, url, kind, amount):
+        with self.lock:
+            host_bucket = self.host_buckets.get(urlparse(url).netloc)
+        global_bucket = self.global_bytes if kind == 'bytes' else self.global_requests
+        delay = global_bucket.reserve(amount)
+        if host_bucket:
+            delay = max(delay, host_bucket[kind].reserve(amount))
+        if delay > 0:
+            time.sleep(delay)
+    
+    def acquire_request(self, url):
+        """发起请求前调用，超出请求频率时阻塞"""
+        self._wait(url, 'requests', 1)
+    
+    def consume_bytes(self, url, size):
+        """收到响应后调用，超出带宽时阻塞以偿还透支的流量"""
+        if size:
+            self._wait(url, 'bytes', size)
+
+class ChapterQueue:
+    """待下载章节队列，支持把阅读器需要的章节提到最前"""
+    def __init__(self, chapters):
+        self.lock = threading.Lock()
+        self.pending = {chapter['index']: chapter for chapter in chapters}
+        self.order = deque(chapter['index'] for chapter in chapters)
+        self.urgent = deque()
+        self.wakeup = Future()
+    
+    def __len__(self):
+        with self.lock:
+            return len(self.pending)
+    
+    def pop(self):
+        """取出下一个章节，返回 (章节, 是否加急)，队列为空时返回 (None, False)"""
+        with self.lock:
+            for queue, urgent in ((self.urgent, True), (self.order, False)):
+                while queue:
+                    index = queue.popleft()
+                    if index in self.pending:
+                        return self.pending.pop(index), urgent
+            return None, False
+    
+    def has_urgent(self):
+        with self.lock:
+            return any(index in self.pending for index in self.urgent)
+    
+    def boost(self, indices):
+        """把指定章节按给定顺序移到队首，返回实际被提前的章节"""
+        with self.lock:
+            boosted = [index for index in indices if index in self.pending]
+            if boosted:
+                self.urgent = deque(boosted + [index for index in self.urgent if index not in boosted])
+                if not self.wakeup.done():
+                    self.wakeup.set_result(True)
+            return boosted
+    
+    def clear(self):
+        with self.lock:
+            self.pending.clear()
+    
+    def take_wakeup(self):
+        """返回用于唤醒调度循环的 Future，已触发过的会被替换"""
+        with self.lock:
+            if self.wakeup.done():
+                self.wakeup = Future()
+            return self.wakeup
+
+class FailureLedger:
+    """单本小说的失败章节记录，保存在小说目录下，供只重试失败章节使用"""
+    def __init__(self, novel_dir):
+        self.ledger_file = os.path.join(novel_dir, "failed_chapters.json")
+        self.lock = threading.Lock()
+        self.data = self.load_ledger()
+    
+    def load_ledger(self):
+        try:
+            if os.path.exists(self.ledger_file):
+                with open(self.ledger_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+        except Exception as e:
+            print(f"加载失败记录失败: {e}")
+        return {'toc_time': 0, 'entries': {}}
+    
+    def save_ledger(self):
+        try:
+            with self.lock:
+                if not self.data['entries']:
+                    if os.path.exists(self.ledger_file):
+                        os.remove(self.ledger_file)
+                    return
+                tmp_file = self.ledger_file + ".tmp"
+                with open(tmp_file, 'w', encoding='utf-8') as f:
+                    json.dump(self.data, f, ensure_ascii=False, indent=2)
+                os.replace(tmp_file, self.ledger_file)
+        except Exception as e:
+            print(f"保存失败记录失败: {e}")
+    
+    def mark_toc_fetched(self):
+        """记录目录页获取时间，用于判断记录中的章节地址是否仍然可信"""
+        self.data['toc_time'] = time.time()
+    
+    def is_fresh(self, max_age):
+        return time.time() - self.data.get('toc_time', 0) <= max_age
+    
+    def record_failure(self, record):
+        """记录失败章节并立即写盘，下载被中断时记录也不会丢失"""
+        key = str(record['index'])
+        with self.lock:
+            entry = self.data['entries'].get(key, {'attempts': 0})
+            entry.update({
+                'index': record['index'],
+                'title': record['title'],
+                'url': record['url'],
+                'error': record.get('error'),
+                'status': record.get('status'),
+                'attempts': entry['attempts'] + record.get('attempts', 1),
+                'last_attempt': datetime.now().isoformat()
+            })
+            self.data['entries'][key] = entry
+        self.save_ledger()
+    
+    def clear(self, index):
+        with self.lock:
+            removed = self.data['entries'].pop(str(index), None)
+        if removed is not None:
+            self.save_ledger()
+    
+    def chapters(self):
+        """按章节顺序返回记录中的章节"""
+        with self.lock:
+            entries = list(self.data['entries'].values())
+        return sorted(entries, key=lambda entry: entry['index'])
 
 class NovelSpider:
-    def __init__(self, base_url="https://www.577ff.cfd", max_workers=5):
+    def __init__(self, base_url="https://www.577ff.cfd", max_workers=5, mirrors=None,
+                 hedge=False, hedge_percentile=0.95, hedge_budget=0.1,
+                 connect_timeout=5, read_timeout=10, governor=None, cleaner=True, store=False,
+                 proxies=None):
         self.base_url = base_url
         self.max_workers = max_workers
+        self.governor = governor
+        # 正文清理，传入 ContentCleaner 实例可自定义广告短语，传入 False 关闭
+        self.cleaner = ContentCleaner() if cleaner is True else (cleaner or None)
+        # 内容寻址存储，开启后在下载目录下的 .store 中按哈希保存章节并记录修订历史
+        self.use_store = store
+        self._stores = {}
+        # 正在下载的小说的章节队列，供 prioritize 调整顺序
+        self._queues = {}
+        self.mirrors = list(mirrors or [])
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
         self.session = requests.Session()
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
@@ -29,25 +269,117 @@ class NovelSpider:
             'Connection': 'keep-alive',
             'Upgrade-Insecure-Requests': '1',
         })
+        # 代理池：传入代理地址列表或 ProxyPool，每个代理使用独立会话，按健康分数分配请求
+        if proxies and not isinstance(proxies, ProxyPool):
+            proxies = ProxyPool(proxies, headers=dict(self.session.headers), pool_size=max_workers * 2)
+        self.proxy_pool = proxies or None
+        
         self.progress_file = "download_progress.json"
         self.lock = threading.Lock()
+        # 每个线程最近一次请求的尝试次数和错误，用于失败记录
+        self._local = threading.local()
+        
+        # 对冲请求：请求耗时超过近期分位数时，向同一站点或镜像再发一份，先返回者胜出
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_budget = hedge_budget
+        self.latency = LatencyTracker()
+        self.metrics = {'requests': 0, 'hedges': 0, 'hedge_wins': 0, 'hedges_skipped': 0}
+        self._hedge_executor = ThreadPoolExecutor(max_workers=max_workers * 2) if hedge else None
+    
+    def _request(self, url, headers=None):
+        """发送单个请求并记录耗时"""
+        if self.governor:
+            with tracer.span('rate_limit_wait'):
+                self.governor.acquire_request(url)
+        proxy = self.proxy_pool.acquire() if self.proxy_pool else None
+        session = proxy.session if proxy else self.session
+        start = time.perf_counter()
+        try:
+            response = session.get(url, headers=headers,
+                                   timeout=(self.connect_timeout, self.read_timeout))
+        except requests.RequestException:
+            if proxy:
+                self.proxy_pool.report(proxy, False)
+            raise
+        end = time.perf_counter()
+        elapsed = end - start
+        if proxy:
+            self.proxy_pool.report(proxy, response.status_code not in PROXY_FAILURE_STATUS, elapsed)
+        if tracer.enabled:
+            # requests 的 elapsed 为发出请求到解析完响应头的时间，其余为读取响应体
+            header_time = min(elapsed, response.elapsed.total_seconds())
+            tracer.record('connect_and_wait', start, start + header_time, url=url,
+                          status=response.status_code)
+            tracer.record('read_body', start + header_time, end, bytes=len(response.content))
+        if self.governor:
+            with tracer.span('rate_limit_wait'):
+                self.governor.consume_bytes(url, len(response.content))
+        response.raise_for_status()
+        self.latency.add(elapsed)
+        return response
+    
+    def _hedge_url(self, url):
+        """选择对冲请求的目标地址，配置了镜像时轮流使用镜像"""
+        if self.mirrors and url.startswith(self.base_url):
+            mirror = self.mirrors[self.metrics['hedges'] % len(self.mirrors)]
+            return mirror.rstrip('/') + url[len(self.base_url):]
+        return url
+    
+    def _take_hedge_budget(self):
+        """对冲次数不超过总请求数的 hedge_budget 比例"""
+        with self.lock:
+            if self.metrics['hedges'] + 1 > max(1, self.metrics['requests'] * self.hedge_budget):
+                self.metrics['hedges_skipped'] += 1
+                return False
+            self.metrics['hedges'] += 1
+            return True
+    
+    def _fetch(self, url, headers=None):
+        """获取响应，启用对冲时慢请求会触发一次备份请求"""
+        with self.lock:
+            self.metrics['requests'] += 1
+        
+        if not self.hedge:
+            return self._request(url, headers)
         
+        delay = self.latency.percentile(self.hedge_percentile)
+        primary = self._hedge_executor.submit(self._request, url, headers)
+        if delay is None:
+            return primary.result()
+        
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._take_hedge_budget():
+            return primary.result()
+        
+        hedge = self._hedge_executor.submit(self._request, self._hedge_url(url), headers)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response = future.result()
+                except Exception as e:
+                    error = error or e
+                    continue
+                if future is hedge:
+                    with self.lock:
+                        self.metrics['hedge_wins'] += 1
+                return response
+        raise error
+    @traced()
     def get_page_content(self, url, retries=3):
         """获取页面内容，包含重试机制"""
+        self._local.error = None
         for attempt in range(retries):
+            self._local.attempts = attempt + 1
             try:
-                response = self.session.get(url, timeout=10)
-                response.raise_for_status()
-                
-                # 自动检测编码
-                detected = chardet.detect(response.content)
-                encoding = detected.get('encoding', 'utf-8')
-                if encoding.lower() in ['gb2312', 'gbk']:
-                    encoding = 'gbk'
-                
-                response.encoding = encoding
-                return response.text
+                response = self._fetch(url)
+                self._local.error = None
+                return self.decode_response(response)
             except Exception as e:
+                self._local.error = e
                 print(f"获取页面失败 (尝试 {attempt + 1}/{retries}): {url}")
                 print(f"错误: {e}")
                 if attempt < retries - 1:
@@ -56,12 +388,52 @@ class NovelSpider:
                     return None
         return None
     
-    def parse_novel_info(self, novel_id):
-        """解析小说基本信息和章节列表"""
-        novel_url = f"{self.base_url}/book/{novel_id}/"
-        print(f"正在解析小说信息: {novel_url}")
+    def decode_response(self, response):
+        """自动检测编码并返回文本"""
+        with tracer.span('chardet'):
+            detected = chardet.detect(response.content)
+        encoding = detected.get('encoding') or 'utf-8'
+        if encoding.lower() in ['gb2312', 'gbk']:
+            encoding = 'gbk'
+        
+        response.encoding = encoding
+        with tracer.span('decode', encoding=encoding):
+            return response.text
+    
+    def novel_url(self, novel_id):
+        return f"{self.base_url}/book/{novel_id}/"
+    
+    def fetch_toc(self, novel_id, etag=None, last_modified=None):
+        """条件请求目录页，页面未变化（304）时返回 None"""
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        
+        response = self._fetch(self.novel_url(novel_id), headers)
+        if response.status_code == 304:
+            return None
         
-        content = self.get_page_content(novel_url)
+        return {
+            'content': self.decode_response(response),
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified')
+        }
+    
+    @staticmethod
+    def toc_fingerprint(content):
+        """不解析 HTML，直接用章节链接计算目录指纹，广告等无关变化不影响结果"""
+        links = re.findall(r'href=["\']([^"\']*?\d+\.html?)["\']', content)
+        digest = hashlib.sha1('\n'.join(links).encode('utf-8')).hexdigest()
+        return digest, len(links)
+    
+    def parse_novel_info(self, novel_id, content=None):
+        """解析小说基本信息和章节列表，content 为已获取的目录页时不再请求"""
+        novel_url = self.novel_url(novel_id)
+        if content is None:
+            print(f"正在解析小说信息: {novel_url}")
+            content = self.get_page_content(novel_url)
         if not content:
             raise Exception(f"无法获取小说页面: {novel_url}")
         
@@ -119,13 +491,15 @@ class NovelSpider:
             'novel_id': novel_id
         }
     
+    @traced()
     def extract_chapter_content(self, chapter_url):
         """提取章节内容"""
         content = self.get_page_content(chapter_url)
         if not content:
             return None
         
-        soup = BeautifulSoup(content, 'html.parser')
+        with tracer.span('bs4_parse', chars=len(content)):
+            soup = BeautifulSoup(content, 'html.parser')
         
         # 尝试多种内容选择器
         content_selectors = [
@@ -140,79 +514,244 @@ class NovelSpider:
         ]
         
         chapter_content = None
-        for selector in content_selectors:
-            content_elem = soup.select_one(selector)
-            if content_elem:
-                chapter_content = content_elem
-                break
-        
-        if not chapter_content:
-            # 如果没有找到内容区域，尝试查找最大的文本块
-            text_elements = soup.find_all(['div', 'p'], string=True)
-            if text_elements:
-                chapter_content = max(text_elements, key=lambda x: len(x.get_text()))
+        with tracer.span('bs4_select'):
+            for selector in content_selectors:
+                content_elem = soup.select_one(selector)
+                if content_elem:
+                    chapter_content = content_elem
+                    break
+            
+            if not chapter_content:
+                # 如果没有找到内容区域，尝试查找最大的文本块
+                text_elements = soup.find_all(['div', 'p'], string=True)
+                if text_elements:
+                    chapter_content = max(text_elements, key=lambda x: len(x.get_text()))
         
         if chapter_content:
-            # 清理内容
-            for script in chapter_content(["script", "style"]):
-                script.decompose()
-            
-            text = chapter_content.get_text()
-            # 清理多余的空白字符
-            text = re.sub(r'\n\s*\n', '\n\n', text)
-            text = re.sub(r'[ \t]+', ' ', text)
-            text = text.strip()
+            with tracer.span('text_cleanup'):
+                # 清理内容
+                for script in chapter_content(["script", "style"]):
+                    script.decompose()
+                
+                text = chapter_content.get_text()
+                # 清理多余的空白字符
+                text = re.sub(r'\n\s*\n', '\n\n', text)
+                text = re.sub(r'[ \t]+', ' ', text)
+                text = text.strip()
             
             return text
         
         return None
     
-    def download_chapter(self, chapter_info, novel_dir, progress_data):
-        """下载单个章节"""
-        chapter_index = chapter_info['index']
-        chapter_title = chapter_info['title']
-        chapter_url = chapter_info['url']
+    @traced()
+    def fetch_chapter(self, chapter_info, novel_id=None):
+        """下载并提取单个章节，返回章节记录，失败时 content 为 None"""
+        print(f"正在下载第 {chapter_info['index']} 章: {chapter_info['title']}")
+        record = {
+            'index': chapter_info['index'],
+            'title': chapter_info['title'],
+            'url': chapter_info['url'],
+            'content': None
+        }
+        try:
+            content = self.extract_chapter_content(chapter_info['url'])
+            if content and self.cleaner:
+                with tracer.span('content_cleaner'):
+                    content = self.cleaner.clean(content, novel_id)
+            record['content'] = content
+            error = getattr(self._local, 'error', None)
+        except Exception as e:
+            print(f"章节 {chapter_info['index']} 下载异常: {e}")
+            error = e
         
-        # 检查是否已下载
-        if str(chapter_index) in progress_data.get('completed_chapters', []):
-            print(f"章节 {chapter_index} 已存在，跳过")
-            return True
+        if not record['content']:
+            response = getattr(error, 'response', None)
+            record['error'] = type(error).__name__ if error else 'ContentNotFound'
+            record['status'] = getattr(response, 'status_code', None)
+            record['attempts'] = getattr(self._local, 'attempts', 1)
+        return record
+    
+    def iter_chapters(self, novel_id, ordered=True, novel_info=None, skip=None, window=None,
+                      cancel_event=None):
+        """边下载边产出章节记录，不写磁盘
         
-        print(f"正在下载第 {chapter_index} 章: {chapter_title}")
+        ordered 为 True 时按章节顺序产出，否则按完成顺序产出；
+        在途和等待产出的章节总数不超过 window，内存占用有上限；
+        cancel_event 被设置后不再提交新章节，已在途和已下载的章节仍会产出（中间有空缺时跳过空缺）
+        """
+        if novel_info is None:
+            novel_info = self.parse_novel_info(novel_id)
+        skip = skip or set()
+        chapters = [c for c in novel_info['chapters'] if str(c['index']) not in skip]
+        positions = {chapter['index']: position for position, chapter in enumerate(chapters)}
+        queue = ChapterQueue(chapters)
+        window = window or self.max_workers * 2
         
-        content = self.extract_chapter_content(chapter_url)
-        if content:
-            # 清理文件名
-            safe_title = re.sub(r'[<>:"/\\|?*]', '_', chapter_title)
-            filename = f"{chapter_index:04d}_{safe_title}.txt"
-            filepath = os.path.join(novel_dir, filename)
+        in_flight = {}
+        buffered = {}
+        urgent_positions = set()  # 加急章节不占用窗口，避免顺序模式下被远处章节占满
+        next_position = 0
+        
+        with self.lock:
+            self._queues[novel_id] = queue
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor, \
+                    ThreadPoolExecutor(max_workers=1) as urgent_executor:
+                while len(queue) or in_flight or buffered:
+                    if cancel_event is not None and cancel_event.is_set():
+                        queue.clear()
+                    
+                    # 阅读器请求的章节交给单独的线程立即下载，不等待普通队列
+                    while queue.has_urgent():
+                        chapter, _ = queue.pop()
+                        future = urgent_executor.submit(self.fetch_chapter, chapter, novel_id)
+                        in_flight[future] = positions[chapter['index']]
+                        urgent_positions.add(positions[chapter['index']])
+                    
+                    while len(in_flight) + len(buffered) - len(urgent_positions) < window:
+                        chapter, urgent = queue.pop()
+                        if chapter is None:
+                            break
+                        future = executor.submit(self.fetch_chapter, chapter, novel_id)
+                        in_flight[future] = positions[chapter['index']]
+                    
+                    if ordered and next_position in buffered:
+                        urgent_positions.discard(next_position)
+                        yield buffered.pop(next_position)
+                        next_position += 1
+                        continue
+                    
+                    if not in_flight:
+                        if not len(queue):
+                            # 取消后被加急提前的章节之前可能留下空缺，按顺序产出已下载的章节后结束
+                            for position in sorted(buffered):
+                                yield buffered[position]
+                            buffered.clear()
+                            break
+                        # 窗口被等待空缺的章节占满时，不受窗口限制提交下一章
+                        chapter, _ = queue.pop()
+                        if chapter is not None:
+                            future = executor.submit(self.fetch_chapter, chapter, novel_id)
+                            in_flight[future] = positions[chapter['index']]
+                        continue
+                    wakeup = queue.take_wakeup()
+                    done, _ = wait(list(in_flight) + [wakeup], return_when=FIRST_COMPLETED)
+                    for future in done:
+                        if future is wakeup:
+                            continue
+                        position = in_flight.pop(future)
+                        if ordered:
+                            buffered[position] = future.result()
+                        else:
+                            urgent_positions.discard(position)
+                            yield future.result()
+        finally:
+            with self.lock:
+                if self._queues.get(novel_id) is queue:
+                    del self._queues[novel_id]
+    
+    def prioritize(self, novel_id, indices):
+        """把正在下载的小说中指定的章节移到队首并立即开始下载，返回实际被提前的章节"""
+        with self.lock:
+            queue = self._queues.get(novel_id)
+        if queue is None:
+            return []
+        return queue.boost(list(indices))
+    
+    async def aiter_chapters(self, novel_id, ordered=True, **kwargs):
+        """iter_chapters 的异步版本，同步生成器在线程池中推进，不阻塞事件循环
+
+        消费方提前退出或被取消时设置 cancel_event（未传入时自动创建），不再提交新章节
+        """
+        loop = asyncio.get_running_loop()
+        cancel_event = kwargs.pop('cancel_event', None) or threading.Event()
+        chapters = self.iter_chapters(novel_id, ordered=ordered, cancel_event=cancel_event, **kwargs)
+        finished = object()
+        record = pending = None
+        try:
+            while True:
+                pending = loop.run_in_executor(None, next, chapters, finished)
+                # shield：任务被取消时 pending 不随之取消，finally 中仍能等到 next 返回
+                record = await asyncio.shield(pending)
+                pending = None
+                if record is finished:
+                    break
+                yield record
+        finally:
+            if pending is not None:
+                # 线程中的 next 仍在执行，等它返回后才能关闭生成器
+                cancel_event.set()
+                await asyncio.wait([pending])
+            elif record is not finished:
+                cancel_event.set()
+            await loop.run_in_executor(None, chapters.close)
+    
+    def get_store(self, novel_dir):
+        """返回小说所在下载目录对应的章节存储，未开启时返回 None"""
+        if not self.use_store:
+            return None
+        root = os.path.join(os.path.dirname(os.path.abspath(novel_dir)), ".store")
+        with self.lock:
+            if root not in self._stores:
+                self._stores[root] = ChapterStore(root)
+            return self._stores[root]
+    
+    @traced()
+    def save_chapter(self, record, novel_dir, progress_data, novel_id=None):
+        """把章节记录写入文件并更新进度
+
+        progress_data 为整个进度文件的内容，本章记入其中 novel_id 对应的条目
+        """
+        chapter_index = record['index']
+        chapter_title = record['title']
+        
+        filepath = os.path.join(novel_dir, book_index.chapter_filename(chapter_index, chapter_title))
+        
+        try:
+            store = self.get_store(novel_dir) if novel_id is not None else None
+            changed = True
+            if store:
+                with tracer.span('store_chapter'):
+                    _, changed = store.record_chapter(novel_id, chapter_index, chapter_title, record['content'])
             
-            try:
-                with open(filepath, 'w', encoding='utf-8') as f:
-                    f.write(f"第{chapter_index}章 {chapter_title}\n\n")
-                    f.write(content)
-                
-                # 更新进度
-                with self.lock:
-                    if 'completed_chapters' not in progress_data:
-                        progress_data['completed_chapters'] = []
-                    progress_data['completed_chapters'].append(str(chapter_index))
-                    self.save_progress(progress_data)
-                
-                print(f"✓ 第 {chapter_index} 章下载完成")
-                return True
-            except Exception as e:
-                print(f"✗ 第 {chapter_index} 章保存失败: {e}")
-                return False
-        else:
-            print(f"✗ 第 {chapter_index} 章内容提取失败")
+            # 内容未变化且文件已存在时不重复写入
+            if changed or not os.path.exists(filepath):
+                with tracer.span('write_file'):
+                    with open(filepath, 'w', encoding='utf-8') as f:
+                        f.write(f"第{chapter_index}章 {chapter_title}\n\n")
+                        f.write(record['content'])
+            
+            # 更新进度
+            with self.lock, tracer.span('save_progress'):
+                entry = progress_data.setdefault(novel_id, {})
+                entry.setdefault('completed_chapters', []).append(str(chapter_index))
+                self.save_progress(progress_data)
+            
+            print(f"✓ 第 {chapter_index} 章下载完成")
+            return True
+        except Exception as e:
+            print(f"✗ 第 {chapter_index} 章保存失败: {e}")
             return False
     
     def save_progress(self, progress_data):
-        """保存下载进度"""
+        """保存下载进度，调用方持有 self.lock
+
+        先与文件中的进度合并再写入：同一个爬虫同时下载多本小说时（例如服务模式），
+        各任务只持有自己加载时的进度，直接覆盖会丢掉其他任务记录的章节
+        """
         try:
-            with open(self.progress_file, 'w', encoding='utf-8') as f:
-                json.dump(progress_data, f, ensure_ascii=False, indent=2)
+            merged = self.load_progress()
+            for novel_id, entry in progress_data.items():
+                current = merged.setdefault(novel_id, {})
+                completed = current.get('completed_chapters', [])
+                known = set(completed)
+                current.update(entry)
+                current['completed_chapters'] = completed + [
+                    index for index in entry.get('completed_chapters', []) if index not in known]
+            tmp_file = self.progress_file + ".tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(merged, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_file, self.progress_file)
         except Exception as e:
             print(f"保存进度失败: {e}")
     
@@ -226,17 +765,38 @@ class NovelSpider:
             print(f"加载进度失败: {e}")
         return {}
     
-    def download_novel(self, novel_id, output_dir="novels"):
-        """下载整本小说"""
+    @staticmethod
+    def _notify(progress_callback, event_type, **data):
+        """向调用方报告进度事件，回调出错不影响下载"""
+        if progress_callback is None:
+            return
+        try:
+            progress_callback(dict(data, type=event_type))
+        except Exception as e:
+            print(f"进度回调出错: {e}")
+    
+    def download_novel(self, novel_id, output_dir="novels", novel_info=None,
+                       progress_callback=None, cancel_event=None):
+        """下载整本小说
+        
+        novel_info 为已解析的目录时跳过目录请求；progress_callback 接收进度事件字典；
+        cancel_event 被设置后停止提交新章节，已下载的章节照常保存和合并
+        """
         try:
             # 解析小说信息
-            novel_info = self.parse_novel_info(novel_id)
+            if novel_info is None:
+                novel_info = self.parse_novel_info(novel_id)
             novel_title = novel_info['title']
             chapters = novel_info['chapters']
             
             # 创建小说目录
             novel_dir = os.path.join(output_dir, f"{novel_id}_{novel_title}")
             os.makedirs(novel_dir, exist_ok=True)
+            if self.cleaner:
+                self.cleaner.load_boilerplate(novel_id, novel_dir)
+            
+            ledger = FailureLedger(novel_dir)
+            ledger.mark_toc_fetched()
             
             # 加载进度
             progress_data = self.load_progress()
@@ -251,30 +811,41 @@ class NovelSpider:
             print(f"总章节数: {len(chapters)}")
             print(f"已完成: {len(progress_data[novel_id].get('completed_chapters', []))} 章")
             
-            # 多线程下载
-            success_count = 0
+            # 多线程下载，写文件只是章节流的一个消费者
+            completed = set(progress_data[novel_id].get('completed_chapters', []))
+            success_count = sum(1 for chapter in chapters if str(chapter['index']) in completed)
             failed_chapters = []
+            self._notify(progress_callback, 'start', novel_id=novel_id, title=novel_title,
+                         novel_dir=novel_dir, total=len(chapters), completed=success_count)
             
-            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-                future_to_chapter = {
-                    executor.submit(self.download_chapter, chapter, novel_dir, progress_data[novel_id]): chapter
-                    for chapter in chapters
-                }
-                
-                for future in as_completed(future_to_chapter):
-                    chapter = future_to_chapter[future]
-                    try:
-                        success = future.result()
-                        if success:
-                            success_count += 1
-                        else:
-                            failed_chapters.append(chapter)
-                    except Exception as e:
-                        print(f"章节 {chapter['index']} 下载异常: {e}")
-                        failed_chapters.append(chapter)
+            store = self.get_store(novel_dir)
+            try:
+                for record in self.iter_chapters(novel_id, ordered=False, novel_info=novel_info, skip=completed,
+                                                 cancel_event=cancel_event):
+                    if not record['content']:
+                        print(f"✗ 第 {record['index']} 章内容提取失败")
+                        failed_chapters.append(record)
+                        ledger.record_failure(record)
+                    elif self.save_chapter(record, novel_dir, progress_data, novel_id):
+                        success_count += 1
+                        ledger.clear(record['index'])
+                    else:
+                        record['error'] = 'SaveError'
+                        failed_chapters.append(record)
+                        ledger.record_failure(record)
+                    self._notify(progress_callback, 'chapter', index=record['index'], title=record['title'],
+                                 ok=bool(record['content']) and 'error' not in record,
+                                 completed=success_count, failed=len(failed_chapters), total=len(chapters))
+            finally:
+                if store:
+                    store.set_title(novel_id, novel_title)
+                    store.flush()
+                ledger.save_ledger()
             
             # 生成合并文件
-            self.merge_chapters(novel_dir, novel_title)
+            if self.cleaner:
+                self.cleaner.save_boilerplate(novel_id, novel_dir)
+            self.merge_chapters(novel_dir, novel_title, novel_id)
             
             print(f"\n下载完成!")
             print(f"成功: {success_count} 章")
@@ -285,14 +856,100 @@ class NovelSpider:
                 for chapter in failed_chapters:
                     print(f"  第 {chapter['index']} 章: {chapter['title']}")
             
+            if self.hedge:
+                print(f"对冲请求: {self.metrics['hedges']} 次，"
+                      f"其中 {self.metrics['hedge_wins']} 次先于原请求返回，"
+                      f"因预算限制跳过 {self.metrics['hedges_skipped']} 次")
+            if self.cleaner:
+                print(self.cleaner.report())
+            if self.proxy_pool:
+                for proxy in self.proxy_pool.stats():
+                    status = "隔离中" if proxy['quarantined'] else "正常"
+                    print(f"代理 {proxy['proxy']}: {proxy['requests']} 次请求，"
+                          f"成功率 {proxy['success_rate']:.0%}，分数 {proxy['score']}，{status}")
+            
+            cancelled = cancel_event is not None and cancel_event.is_set()
+            self._notify(progress_callback, 'done', novel_dir=novel_dir, completed=success_count,
+                         failed=len(failed_chapters), total=len(chapters), cancelled=cancelled)
             return novel_dir
             
         except Exception as e:
             print(f"下载失败: {e}")
+            self._notify(progress_callback, 'error', message=str(e))
             return None
     
-    def merge_chapters(self, novel_dir, novel_title):
-        """合并所有章节为一个完整文件"""
+    def find_novel_dir(self, novel_id, output_dir="novels"):
+        """查找已下载小说的目录"""
+        if os.path.isdir(output_dir):
+            for item in os.listdir(output_dir):
+                if item.startswith(f"{novel_id}_") and os.path.isdir(os.path.join(output_dir, item)):
+                    return os.path.join(output_dir, item)
+        return None
+    
+    def retry_failed(self, novel_id, output_dir="novels", max_age=24 * 3600,
+                     progress_callback=None, cancel_event=None):
+        """只重试失败记录中的章节；记录足够新时不再请求目录页"""
+        novel_dir = self.find_novel_dir(novel_id, output_dir)
+        if not novel_dir:
+            print(f"未找到小说 {novel_id} 的下载目录")
+            return None
+        
+        ledger = FailureLedger(novel_dir)
+        chapters = ledger.chapters()
+        if not chapters:
+            print("没有需要重试的章节")
+            return novel_dir
+        if self.cleaner:
+            self.cleaner.load_boilerplate(novel_id, novel_dir)
+        
+        novel_title = os.path.basename(novel_dir)[len(novel_id) + 1:]
+        if not ledger.is_fresh(max_age):
+            # 记录过旧，章节地址可能已变化，重新获取目录
+            try:
+                latest = {c['index']: c for c in self.parse_novel_info(novel_id)['chapters']}
+                chapters = [dict(entry, url=latest[entry['index']]['url']) if entry['index'] in latest else entry
+                            for entry in chapters]
+                ledger.mark_toc_fetched()
+            except Exception as e:
+                print(f"刷新目录失败，使用原有地址重试: {e}")
+        
+        print(f"重试 {len(chapters)} 个失败章节")
+        progress_data = self.load_progress()
+        progress_data.setdefault(novel_id, {'title': novel_title, 'completed_chapters': []})
+        
+        success_count = 0
+        failed_count = 0
+        novel_info = {'title': novel_title, 'chapters': chapters, 'novel_id': novel_id}
+        self._notify(progress_callback, 'start', novel_id=novel_id, title=novel_title,
+                     novel_dir=novel_dir, total=len(chapters), completed=0)
+        store = self.get_store(novel_dir)
+        try:
+            for record in self.iter_chapters(novel_id, ordered=False, novel_info=novel_info,
+                                             cancel_event=cancel_event):
+                ok = bool(record['content']) and self.save_chapter(record, novel_dir, progress_data, novel_id)
+                if ok:
+                    success_count += 1
+                    ledger.clear(record['index'])
+                else:
+                    failed_count += 1
+                    ledger.record_failure(record)
+                self._notify(progress_callback, 'chapter', index=record['index'], title=record['title'], ok=ok,
+                             completed=success_count, failed=failed_count, total=len(chapters))
+        finally:
+            if store:
+                store.flush()
+            ledger.save_ledger()
+        
+        if success_count:
+            self.merge_chapters(novel_dir, novel_title, novel_id)
+        print(f"重试完成: 成功 {success_count} 章，仍失败 {len(chapters) - success_count} 章")
+        self._notify(progress_callback, 'done', novel_dir=novel_dir, completed=success_count,
+                     failed=failed_count, total=len(chapters),
+                     cancelled=cancel_event is not None and cancel_event.is_set())
+        return novel_dir
+    
+    def merge_chapters(self, novel_dir, novel_title, novel_id=None):
+        """合并所有章节为一个完整文件，并写入记录各章字节偏移的清单"""
         try:
             merged_file = os.path.join(novel_dir, f"{novel_title}_完整版.txt")
             
@@ -300,19 +957,44 @@ class NovelSpider:
             chapter_files = [f for f in os.listdir(novel_dir) if f.endswith('.txt') and not f.endswith('_完整版.txt')]
             chapter_files.sort(key=lambda x: int(x.split('_')[0]))
             
-            with open(merged_file, 'w', encoding='utf-8') as merged:
-                merged.write(f"{novel_title}\n\n")
+            manifest_chapters = []
+            digest = hashlib.sha1()
+            offset = 0
+            separator = ("\n\n" + "="*50 + "\n\n").encode('utf-8')
+            
+            def write(data):
+                nonlocal offset
+                merged.write(data)
+                digest.update(data)
+                offset += len(data)
+            
+            # 先写临时文件再替换：阅读器可能正以 mmap 打开旧文件，原地截断会使其读取时崩溃
+            tmp_file = merged_file + ".tmp"
+            with open(tmp_file, 'wb') as merged:
+                write(f"{novel_title}\n\n".encode('utf-8'))
                 
                 for chapter_file in chapter_files:
                     chapter_path = os.path.join(novel_dir, chapter_file)
                     try:
                         with open(chapter_path, 'r', encoding='utf-8') as f:
                             content = f.read()
-                            merged.write(content)
-                            merged.write("\n\n" + "="*50 + "\n\n")
+                        # 只清理合并后的文本，章节文件保持下载时的内容，误删的行可以恢复
+                        if self.cleaner and novel_id is not None:
+                            content = self.cleaner.strip_boilerplate(content, novel_id)
+                        data = content.encode('utf-8')
+                        manifest_chapters.append({
+                            'title': content.split('\n', 1)[0].strip(),
+                            'offset': offset,
+                            'length': len(data),
+                            'chars': len(content)
+                        })
+                        write(data)
+                        write(separator)
                     except Exception as e:
                         print(f"合并章节 {chapter_file} 失败: {e}")
+            os.replace(tmp_file, merged_file)
             
+            book_index.save_manifest(merged_file, novel_title, manifest_chapters, digest.hexdigest())
             print(f"已生成完整版文件: {merged_file}")
             
         except Exception as e:
@@ -320,22 +1002,32 @@ class NovelSpider:
 
 def main():
     """主函数"""
-    spider = NovelSpider(max_workers=3)  # 设置3个线程
+    # 设置环境变量 NOVEL_STORE=1 开启章节存储，记录站点修改章节前的历史版本
+    spider = NovelSpider(max_workers=3, store=os.environ.get('NOVEL_STORE') == '1')  # 设置3个线程
+    
+    # 设置环境变量 NOVEL_TRACE=trace.json 开启阶段耗时追踪，退出时导出
+    trace_file = os.environ.get('NOVEL_TRACE')
+    if trace_file:
+        tracer.enable()
     
     print("笔趣阁小说下载器")
     print("="*30)
     
     while True:
-        novel_id = input("请输入小说ID (输入 'quit' 退出): ").strip()
+        novel_id = input("请输入小说ID (输入 'retry ID' 只重试失败章节，'quit' 退出): ").strip()
         if novel_id.lower() == 'quit':
             break
         
+        retry = novel_id.lower().startswith('retry ')
+        if retry:
+            novel_id = novel_id[len('retry '):].strip()
+        
         if not novel_id:
             print("请输入有效的小说ID")
             continue
         
         try:
-            result = spider.download_novel(novel_id)
+            result = spider.retry_failed(novel_id) if retry else spider.download_novel(novel_id)
             if result:
                 print(f"小说已保存到: {result}")
             else:
@@ -346,6 +1038,9 @@ def main():
         except Exception as e:
             print(f"发生错误: {e}")
         
+        if trace_file:
+            tracer.export(trace_file)
+        
         print("\n" + "-"*30 + "\n")
 
 if __name__ == "__main__":
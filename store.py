@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+内容寻址的章节存储
+章节正文按 SHA-256 保存为压缩对象，存储内相同内容只有一个对象；每本小说一个清单，
+记录各章节当前版本和被站点修改前的历史版本。清单在下载过程中定期写出，
+中断的下载留下的未引用对象可以通过 gc 回收
+"""
+
+import os
+import sys
+import json
+import zlib
+import time
+import difflib
+import hashlib
+import argparse
+import threading
+
+class ChapterStore:
+    """章节对象存储和小说清单"""
+    def __init__(self, root=os.path.join("novels", ".store"), flush_interval=5.0):
+        self.root = root
+        self.flush_interval = flush_interval
+        self.last_flush = time.time()
+        self.objects_dir = os.path.join(root, "objects")
+        self.manifests_dir = os.path.join(root, "manifests")
+        self.manifests = {}
+        self.dirty = set()
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def digest(text):
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def _object_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest[2:])
+
+    def put(self, text):
+        """保存正文，已存在相同内容时不写盘，返回哈希"""
+        digest = self.digest(text)
+        path = self._object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(zlib.compress(text.encode('utf-8')))
+            os.replace(tmp_path, path)
+        return digest
+
+    def get(self, digest):
+        with open(self._object_path(digest), 'rb') as f:
+            return zlib.decompress(f.read()).decode('utf-8')
+
+    def _manifest_path(self, novel_id):
+        return os.path.join(self.manifests_dir, f"{novel_id}.json")
+
+    def load_manifest(self, novel_id):
+        with self.lock:
+            if novel_id in self.manifests:
+                return self.manifests[novel_id]
+            manifest = {'novel_id': novel_id, 'title': None, 'chapters': {}}
+            try:
+                path = self._manifest_path(novel_id)
+                if os.path.exists(path):
+                    with open(path, 'r', encoding='utf-8') as f:
+                        manifest = json.load(f)
+            except Exception as e:
+                print(f"加载章节清单失败: {e}")
+            self.manifests[novel_id] = manifest
+            return manifest
+
+    def record_chapter(self, novel_id, index, title, text):
+        """登记章节正文，返回 (哈希, 是否有变化)；内容变化时旧版本保留在历史中"""
+        digest = self.put(text)
+        with self.lock:
+            manifest = self.load_manifest(novel_id)
+            entry = manifest['chapters'].get(str(index))
+            if entry and entry['hash'] == digest:
+                return digest, False
+
+            now = time.time()
+            if entry is None:
+                entry = {'title': title, 'hash': digest, 'size': len(text), 'updated': now, 'revisions': []}
+            else:
+                entry['revisions'].append({'hash': entry['hash'], 'size': entry['size'], 'time': entry['updated']})
+                entry.update({'title': title, 'hash': digest, 'size': len(text), 'updated': now})
+            manifest['chapters'][str(index)] = entry
+            self.dirty.add(novel_id)
+            # 定期写出清单，下载中断时已保存的对象仍有清单引用
+            if now - self.last_flush >= self.flush_interval:
+                self.flush()
+            return digest, True
+
+    def set_title(self, novel_id, title):
+        with self.lock:
+            manifest = self.load_manifest(novel_id)
+            if manifest.get('title') != title:
+                manifest['title'] = title
+                self.dirty.add(novel_id)
+
+    def flush(self):
+        """写出有改动的清单"""
+        with self.lock:
+            self.last_flush = time.time()
+            os.makedirs(self.manifests_dir, exist_ok=True)
+            for novel_id in list(self.dirty):
+                path = self._manifest_path(novel_id)
+                try:
+                    with open(path + ".tmp", 'w', encoding='utf-8') as f:
+                        json.dump(self.manifests[novel_id], f, ensure_ascii=False)
+                    os.replace(path + ".tmp", path)
+                    self.dirty.discard(novel_id)
+                except Exception as e:
+                    print(f"保存章节清单失败: {e}")
+
+    def revisions(self, novel_id, index):
+        """返回章节的历史版本（旧到新），最后一项为当前版本"""
+        entry = self.load_manifest(novel_id)['chapters'].get(str(index))
+        if not entry:
+            return []
+        return entry['revisions'] + [{'hash': entry['hash'], 'size': entry['size'], 'time': entry['updated']}]
+
+    def diff(self, novel_id, index, old=-2, new=-1):
+        """对比章节的两个版本，默认对比上一版本和当前版本"""
+        revisions = self.revisions(novel_id, index)
+        if len(revisions) < 2:
+            return ""
+        old_text = self.get(revisions[old]['hash']).splitlines()
+        new_text = self.get(revisions[new]['hash']).splitlines()
+        return '\n'.join(difflib.unified_diff(old_text, new_text, "旧版本", "新版本", lineterm=''))
+
+    def _all_manifests(self):
+        novel_ids = set(self.manifests)
+        if os.path.isdir(self.manifests_dir):
+            novel_ids.update(name[:-len('.json')] for name in os.listdir(self.manifests_dir)
+                             if name.endswith('.json'))
+        return [self.load_manifest(novel_id) for novel_id in sorted(novel_ids)]
+
+    def gc(self, keep_revisions=None, dry_run=False):
+        """回收不再被任何清单引用的对象；keep_revisions 指定时每章只保留最近若干个历史版本"""
+        with self.lock:
+            referenced = set()
+            for manifest in self._all_manifests():
+                for entry in manifest['chapters'].values():
+                    if keep_revisions is not None and len(entry['revisions']) > keep_revisions:
+                        entry['revisions'] = entry['revisions'][-keep_revisions:] if keep_revisions else []
+                        self.dirty.add(manifest['novel_id'])
+                    referenced.add(entry['hash'])
+                    referenced.update(revision['hash'] for revision in entry['revisions'])
+            if not dry_run:
+                self.flush()
+
+            removed = 0
+            freed = 0
+            if os.path.isdir(self.objects_dir):
+                for prefix in os.listdir(self.objects_dir):
+                    prefix_dir = os.path.join(self.objects_dir, prefix)
+                    for name in os.listdir(prefix_dir):
+                        if prefix + name in referenced:
+                            continue
+                        path = os.path.join(prefix_dir, name)
+                        removed += 1
+                        freed += os.path.getsize(path)
+                        if not dry_run:
+                            os.remove(path)
+                    if not dry_run and not os.listdir(prefix_dir):
+                        os.rmdir(prefix_dir)
+            return removed, freed
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="章节存储维护")
+    parser.add_argument('--root', default=os.path.join("novels", ".store"), help="存储目录")
+    subparsers = parser.add_subparsers(dest='command')
+
+    gc_parser = subparsers.add_parser('gc', help="回收未引用的章节对象")
+    gc_parser.add_argument('--keep', type=int, default=None, help="每章保留的历史版本数")
+    gc_parser.add_argument('--dry-run', action='store_true', help="只统计不删除")
+
+    revisions_parser = subparsers.add_parser('revisions', help="查看章节历史版本")
+    revisions_parser.add_argument('novel_id')
+    revisions_parser.add_argument('index', type=int)
+
+    diff_parser = subparsers.add_parser('diff', help="对比章节上一版本和当前版本")
+    diff_parser.add_argument('novel_id')
+    diff_parser.add_argument('index', type=int)
+
+    args = parser.parse_args()
+    store = ChapterStore(args.root)
+
+    if args.command == 'gc':
+        removed, freed = store.gc(args.keep, args.dry_run)
+        action = "可回收" if args.dry_run else "已回收"
+        print(f"{action} {removed} 个对象，共 {freed / 1024:.1f} KB")
+    elif args.command == 'revisions':
+        for i, revision in enumerate(store.revisions(args.novel_id, args.index)):
+            updated = time.strftime('%Y-%m-%d %H:%M', time.localtime(revision['time']))
+            print(f"{i + 1}\t{revision['hash'][:12]}\t{revision['size']} 字\t{updated}")
+    elif args.command == 'diff':
+        print(store.diff(args.novel_id, args.index) or "没有历史版本")
+    else:
+        parser.print_help()
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
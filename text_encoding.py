@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+导入 TXT 的编码识别
+只读取文件开头、中间和结尾的少量样本判断编码，判断结果按文件大小和修改时间缓存，
+再次打开时不必重新识别。UTF-16 等与 ASCII 不兼容的编码无法按分隔线定位章节，
+流式转码为 UTF-8 副本后再使用
+"""
+
+import os
+import json
+import codecs
+import hashlib
+import threading
+
+try:
+    import chardet
+except ImportError:
+    chardet = None
+
+SAMPLE_SIZE = 64 * 1024
+CHUNK_SIZE = 1024 * 1024
+
+BOMS = [
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+
+def normalize_encoding(encoding):
+    """GB2312、GBK 统一按超集 GB18030 解码，避免个别生僻字解码失败"""
+    encoding = codecs.lookup(encoding).name
+    if encoding in ('gb2312', 'gbk', 'hz'):
+        return 'gb18030'
+    if encoding == 'ascii':
+        return 'utf-8'
+    return encoding
+
+def ascii_compatible(encoding):
+    """分隔线和换行的字节与 ASCII 相同时，可以直接按字节偏移切分章节"""
+    return '=\n'.encode(encoding) == b'=\n'
+
+def read_samples(f, size, sample_size=SAMPLE_SIZE):
+    """文件开头、中间和结尾各取一段，大文件也只读取固定的字节数"""
+    if size <= sample_size * 3:
+        f.seek(0)
+        return [f.read()]
+    samples = []
+    for offset in (0, size // 2, size - sample_size):
+        f.seek(offset)
+        samples.append(f.read(sample_size))
+    return samples
+
+def is_utf8(sample, head):
+    """样本能否按 UTF-8 解码；中间截取的样本跳过开头不完整的字符，结尾不完整的字符不算错误"""
+    if not head:
+        skip = 0
+        while skip < 3 and skip < len(sample) and 0x80 <= sample[skip] <= 0xbf:
+            skip += 1
+        sample = sample[skip:]
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        return True
+    except UnicodeDecodeError:
+        return False
+
+def detect_encoding(path, sample_size=SAMPLE_SIZE):
+    """按 BOM、UTF-8 校验、chardet（已安装时）的顺序判断编码，都不确定时按 GB18030 处理"""
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        head = f.read(4)
+        for bom, encoding in BOMS:
+            if head.startswith(bom):
+                return encoding
+        samples = read_samples(f, size, sample_size)
+
+    if all(is_utf8(sample, i == 0) for i, sample in enumerate(samples)):
+        return 'utf-8'
+    if chardet is not None:
+        detected = chardet.detect(b''.join(samples))
+        if detected.get('encoding') and detected.get('confidence', 0) >= 0.5:
+            try:
+                encoding = normalize_encoding(detected['encoding'])
+                if encoding != 'utf-8':
+                    return encoding
+            except LookupError:
+                pass
+    return 'gb18030'
+
+def transcode_to_utf8(src, dst, encoding, chunk_size=CHUNK_SIZE):
+    """分块解码并写入 UTF-8 副本，内存占用与文件大小无关"""
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    tmp_file = dst + ".tmp"
+    with open(src, 'rb') as fin, open(tmp_file, 'w', encoding='utf-8', newline='') as fout:
+        for chunk in iter(lambda: fin.read(chunk_size), b''):
+            fout.write(decoder.decode(chunk))
+        fout.write(decoder.decode(b'', final=True))
+    os.replace(tmp_file, dst)
+
+class EncodingCache:
+    """文件和章节文件夹的编码判断结果，保存在 index_dir/encodings.json 中
+
+    下载线程和搜索索引线程也会读取章节，所有方法都可以在任意线程中调用
+    """
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        self.cache_file = os.path.join(index_dir, "encodings.json")
+        self.lock = threading.Lock()
+        self.entries = self.load_cache()
+
+    def load_cache(self):
+        try:
+            if os.path.exists(self.cache_file):
+                with open(self.cache_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+        except Exception as e:
+            print(f"加载编码缓存失败: {e}")
+        return {}
+
+    def save_cache(self):
+        with self.lock:
+            data = json.dumps(self.entries, ensure_ascii=False, separators=(',', ':'))
+        try:
+            os.makedirs(self.index_dir, exist_ok=True)
+            with open(self.cache_file + ".tmp", 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(self.cache_file + ".tmp", self.cache_file)
+        except OSError as e:
+            print(f"保存编码缓存失败: {e}")
+
+    def copy_path(self, path):
+        key = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()
+        return os.path.join(self.index_dir, key + ".utf8.txt")
+
+    def resolve(self, path):
+        """返回 (实际读取的文件, 编码)；与 ASCII 不兼容的编码返回转码后的 UTF-8 副本
+
+        带 BOM 的 UTF-8 按 UTF-8 直接读取，BOM 由 book_index.scan_chapters 跳过
+        """
+        key = os.path.abspath(path)
+        stat = os.stat(path)
+        with self.lock:
+            entry = self.entries.get(key)
+        # 旧版本把带 BOM 的 UTF-8 也转码成了副本，重新判断一次
+        if (entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns
+                and entry['encoding'] != 'utf-8-sig'):
+            copy = entry.get('copy')
+            if not copy:
+                return path, entry['encoding']
+            if os.path.exists(copy):
+                return copy, 'utf-8'
+
+        encoding = detect_encoding(path)
+        if encoding == 'utf-8-sig':
+            encoding = 'utf-8'
+        entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'encoding': encoding}
+        if not ascii_compatible(encoding):
+            copy = self.copy_path(path)
+            os.makedirs(self.index_dir, exist_ok=True)
+            print(f"正在把 {os.path.basename(path)} 从 {encoding} 转为 UTF-8")
+            transcode_to_utf8(path, copy, encoding)
+            entry['copy'] = copy
+        with self.lock:
+            self.entries[key] = entry
+        self.save_cache()
+        return entry.get('copy', path), 'utf-8' if entry.get('copy') else encoding
+
+    def folder_encoding(self, folder, sample_file):
+        """章节文件夹中的文件通常编码相同，按第一次读取的文件判断一次"""
+        key = os.path.abspath(folder)
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry:
+            return entry['encoding']
+        encoding = detect_encoding(sample_file)
+        with self.lock:
+            self.entries[key] = {'encoding': encoding}
+        self.save_cache()
+        return encoding
+
+    def read_text(self, path):
+        """按所在文件夹的编码读取章节文件，个别文件编码不同时单独识别"""
+        with open(path, 'rb') as f:
+            data = f.read()
+        encoding = self.folder_encoding(os.path.dirname(path), path)
+        try:
+            return codecs.decode(data, encoding)
+        except UnicodeDecodeError:
+            return data.decode(detect_encoding(path), errors='replace')
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+爬虫阶段耗时追踪
+按线程记录各阶段的时间区间，导出为 Chrome / Perfetto 可以打开的 trace-event JSON。
+默认关闭，关闭时每个埋点只多一次属性判断
+"""
+
+import os
+import json
+import time
+import threading
+import functools
+
+class _NullSpan:
+    """追踪关闭时使用的空区间"""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **args):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+class _Span:
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.tracer.record(self.name, self.start, time.perf_counter(), **self.args)
+        return False
+
+    def set(self, **args):
+        """补充区间参数，例如响应大小"""
+        self.args.update(args)
+
+class Tracer:
+    """收集追踪事件"""
+    def __init__(self, max_events=1000000):
+        self.enabled = False
+        self.max_events = max_events
+        self.events = []
+        self.thread_names = {}
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.origin = time.perf_counter()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def clear(self):
+        with self.lock:
+            self.events = []
+            self.thread_names = {}
+            self.dropped = 0
+            self.origin = time.perf_counter()
+
+    def span(self, name, **args):
+        """用法: with tracer.span('parse', url=url): ..."""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, args)
+
+    def record(self, name, start, end, **args):
+        """记录一个已知起止时间（perf_counter 秒）的区间"""
+        if not self.enabled:
+            return
+        thread = threading.current_thread()
+        event = {
+            'name': name,
+            'cat': 'spider',
+            'ph': 'X',
+            'ts': (start - self.origin) * 1e6,
+            'dur': max(0.0, (end - start) * 1e6),
+            'pid': self.pid,
+            'tid': thread.ident,
+        }
+        if args:
+            event['args'] = args
+        with self.lock:
+            if len(self.events) >= self.max_events:
+                self.dropped += 1
+                return
+            self.events.append(event)
+            self.thread_names.setdefault(thread.ident, thread.name)
+
+    def export(self, path):
+        """导出为 trace-event JSON，可在 chrome://tracing 或 ui.perfetto.dev 中打开"""
+        with self.lock:
+            metadata = [{
+                'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid,
+                'args': {'name': name}
+            } for tid, name in self.thread_names.items()]
+            data = {
+                'traceEvents': metadata + list(self.events),
+                'displayTimeUnit': 'ms',
+                'otherData': {'dropped_events': self.dropped}
+            }
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        print(f"追踪数据已导出: {path}（{len(data['traceEvents'])} 个事件）")
+
+tracer = Tracer()
+
+def traced(name=None):
+    """函数级埋点装饰器"""
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return func(*args, **kwargs)
+            with tracer.span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
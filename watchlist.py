@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+小说更新关注列表
+定时轮询关注小说的目录页，使用条件请求和目录指纹判断是否有新章节，
+只有目录变化时才启动增量下载
+"""
+
+import os
+import sys
+import json
+import time
+import heapq
+import random
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from spider import NovelSpider, RateGovernor
+
+class Watchlist:
+    """关注列表：按计划轮询目录页，有更新时才增量下载"""
+    def __init__(self, spider=None, watch_file="watchlist.json", output_dir="novels",
+                 interval=3600, max_interval=6 * 3600, jitter=0.2, poll_workers=4, store=False):
+        self.spider = spider or NovelSpider(max_workers=3, governor=RateGovernor(requests_per_sec=2),
+                                            store=store)
+        self.watch_file = watch_file
+        self.output_dir = output_dir
+        self.interval = interval
+        self.max_interval = max_interval
+        self.jitter = jitter
+        self.poll_workers = poll_workers
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.entries = self.load_watchlist()
+        # 目录有变化的小说在下载成功后才记下新的指纹和 ETag，下载失败时下次检查会重新下载
+        self.pending = {}
+
+    def load_watchlist(self):
+        try:
+            if os.path.exists(self.watch_file):
+                with open(self.watch_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+        except Exception as e:
+            print(f"加载关注列表失败: {e}")
+        return {}
+
+    def save_watchlist(self):
+        """原子写入关注列表"""
+        with self.lock:
+            data = json.dumps(self.entries, ensure_ascii=False, indent=2)
+            self.dirty = False
+        try:
+            tmp_file = self.watch_file + ".tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(tmp_file, self.watch_file)
+        except Exception as e:
+            print(f"保存关注列表失败: {e}")
+
+    def add(self, novel_id, interval=None):
+        with self.lock:
+            if novel_id not in self.entries:
+                self.entries[novel_id] = {
+                    'novel_id': novel_id,
+                    'title': None,
+                    'interval': interval or self.interval,
+                    'base_interval': interval or self.interval,
+                    'etag': None,
+                    'last_modified': None,
+                    'fingerprint': None,
+                    'chapter_count': 0,
+                    'last_check': 0,
+                    'last_change': 0,
+                    'next_check': 0
+                }
+            elif interval:
+                self.entries[novel_id]['interval'] = interval
+                self.entries[novel_id]['base_interval'] = interval
+            self.dirty = True
+
+    def remove(self, novel_id):
+        with self.lock:
+            if self.entries.pop(novel_id, None) is not None:
+                self.dirty = True
+
+    def _schedule(self, entry, changed):
+        """计算下次检查时间：有更新时恢复该小说的基础间隔，否则逐步退避，并加入随机抖动"""
+        base_interval = entry.get('base_interval', self.interval)
+        if changed:
+            entry['interval'] = base_interval
+        else:
+            entry['interval'] = min(max(self.max_interval, base_interval), entry['interval'] * 1.5)
+        spread = entry['interval'] * self.jitter
+        entry['next_check'] = time.time() + entry['interval'] + random.uniform(-spread, spread)
+
+    def check(self, novel_id):
+        """检查单本小说，返回需要下载的目录信息，没有变化时返回 None"""
+        with self.lock:
+            entry = dict(self.entries[novel_id])
+
+        novel_info = None
+        try:
+            toc = self.spider.fetch_toc(novel_id, entry['etag'], entry['last_modified'])
+            if toc is not None:
+                update = {'etag': toc['etag'], 'last_modified': toc['last_modified']}
+                fingerprint, link_count = self.spider.toc_fingerprint(toc['content'])
+                if fingerprint != entry['fingerprint']:
+                    novel_info = self.spider.parse_novel_info(novel_id, toc['content'])
+                    print(f"《{novel_info['title']}》目录有变化: "
+                          f"{entry['chapter_count']} -> {len(novel_info['chapters'])} 章")
+                    update.update({
+                        'title': novel_info['title'],
+                        'fingerprint': fingerprint,
+                        'chapter_count': len(novel_info['chapters']),
+                        'last_change': time.time()
+                    })
+                    with self.lock:
+                        self.pending[novel_id] = update
+                else:
+                    entry.update(update)
+        except Exception as e:
+            print(f"检查小说 {novel_id} 失败: {e}")
+
+        entry['last_check'] = time.time()
+        self._schedule(entry, novel_info is not None)
+        with self.lock:
+            if novel_id in self.entries:
+                self.entries[novel_id] = entry
+                self.dirty = True
+        return novel_info
+
+    def download(self, novel_id, novel_info):
+        """下载有更新的小说，成功后才保存新的目录指纹"""
+        result = self.spider.download_novel(novel_id, self.output_dir, novel_info)
+        with self.lock:
+            update = self.pending.pop(novel_id, None)
+            if result and update and novel_id in self.entries:
+                self.entries[novel_id].update(update)
+                self.dirty = True
+        if not result:
+            print(f"小说 {novel_id} 下载失败，下次检查时重试")
+        return result
+
+    def run(self, stop_event=None, once=False, save_interval=30):
+        """轮询主循环；once 为 True 时只把到期的小说检查一遍"""
+        stop_event = stop_event or threading.Event()
+        poll_executor = ThreadPoolExecutor(max_workers=self.poll_workers)
+        # 下载串行执行，避免同时下载多本小说占满连接
+        download_executor = ThreadPoolExecutor(max_workers=1)
+        in_flight = set()
+        last_save = time.time()
+
+        def on_checked(novel_id, future):
+            novel_info = future.result()
+            if novel_info is not None:
+                download_executor.submit(self.download, novel_id, novel_info)
+            with self.lock:
+                in_flight.discard(novel_id)
+
+        print(f"开始监控 {len(self.entries)} 本小说")
+        try:
+            while not stop_event.is_set():
+                now = time.time()
+                with self.lock:
+                    queue = [(e['next_check'], novel_id) for novel_id, e in self.entries.items()
+                             if novel_id not in in_flight]
+                heapq.heapify(queue)
+
+                while queue and queue[0][0] <= now:
+                    _, novel_id = heapq.heappop(queue)
+                    with self.lock:
+                        in_flight.add(novel_id)
+                    future = poll_executor.submit(self.check, novel_id)
+                    future.add_done_callback(lambda f, nid=novel_id: on_checked(nid, f))
+
+                if self.dirty and (once or time.time() - last_save >= save_interval):
+                    self.save_watchlist()
+                    last_save = time.time()
+
+                if once:
+                    break
+
+                # 睡到下一本到期，最长 save_interval 秒以便及时保存和响应新加入的条目
+                wait_time = queue[0][0] - time.time() if queue else save_interval
+                stop_event.wait(max(1, min(wait_time, save_interval)))
+        finally:
+            poll_executor.shutdown(wait=True)
+            download_executor.shutdown(wait=True)
+            self.save_watchlist()
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="笔趣阁小说更新监控")
+    parser.add_argument('--file', default="watchlist.json", help="关注列表文件")
+    parser.add_argument('--output', default="novels", help="下载保存目录")
+    parser.add_argument('--store', action='store_true', help="开启章节存储，记录章节的历史版本")
+    subparsers = parser.add_subparsers(dest='command')
+
+    add_parser = subparsers.add_parser('add', help="关注小说")
+    add_parser.add_argument('novel_ids', nargs='+')
+    add_parser.add_argument('--interval', type=int, default=None, help="检查间隔（秒）")
+
+    remove_parser = subparsers.add_parser('remove', help="取消关注")
+    remove_parser.add_argument('novel_ids', nargs='+')
+
+    subparsers.add_parser('list', help="查看关注列表")
+    subparsers.add_parser('check', help="检查所有到期的小说一次")
+    subparsers.add_parser('run', help="持续运行监控")
+
+    args = parser.parse_args()
+    watchlist = Watchlist(watch_file=args.file, output_dir=args.output, store=args.store)
+
+    if args.command == 'add':
+        for novel_id in args.novel_ids:
+            watchlist.add(novel_id, args.interval)
+        watchlist.save_watchlist()
+    elif args.command == 'remove':
+        for novel_id in args.novel_ids:
+            watchlist.remove(novel_id)
+        watchlist.save_watchlist()
+    elif args.command == 'list':
+        for novel_id, entry in watchlist.entries.items():
+            last_check = time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['last_check'])) \
+                if entry['last_check'] else "从未"
+            print(f"{novel_id}\t{entry['title'] or '未知'}\t{entry['chapter_count']} 章\t上次检查: {last_check}")
+    elif args.command == 'check':
+        watchlist.run(once=True)
+    elif args.command == 'run':
+        try:
+            watchlist.run()
+        except KeyboardInterrupt:
+            print("\n已停止监控")
+    else:
+        parser.print_help()
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())